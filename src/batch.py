@@ -0,0 +1,80 @@
+"""
+Vectorized move generation over a batch of hands.
+
+Hands are (N, 52) arrays in the layout cards2box produces. The legal
+moves of each hand are a boolean mask over the play catalogue, which
+lists plays in the order Player.find_plays lists them, so masks come out
+in find_plays order.
+"""
+
+import numpy as np
+from card import Play
+from catalogue import get_catalogue
+
+# Rows of hands processed at once, bounds the size of temporaries
+CHUNK_SIZE = 256
+
+
+def boxes2masks(boxes) -> np.ndarray:
+    """Convert an (N, 52) array of boolean lists to N uint64 bitmasks."""
+    packed = np.packbits(
+        np.asarray(boxes, dtype=bool), axis=-1, bitorder="little"
+    )
+    padded = np.zeros(packed.shape[:-1] + (8,), dtype=np.uint8)
+    padded[..., : packed.shape[-1]] = packed
+    return padded.view("<u8")[..., 0]
+
+
+def legal_plays(
+    hand_masks,
+    last_combinations,
+    last_keys,
+    game_start=False,
+) -> np.ndarray:
+    """
+    Return an (N, NUM_PLAYS) boolean mask of the legal plays.
+
+    Row i holds the plays of hand_masks[i] that beat the last play given
+    by last_combinations[i] (CardCombination values) and last_keys[i].
+    game_start may be a scalar or one flag per hand.
+    """
+    catalogue = get_catalogue()
+    hand_masks = np.asarray(hand_masks, dtype=np.uint64)
+    n = len(hand_masks)
+    beats = catalogue.beats_rows(
+        np.broadcast_to(last_combinations, (n,)),
+        np.broadcast_to(last_keys, (n,)),
+    )
+    game_start = np.broadcast_to(game_start, (n,))[:, None]
+    beats &= ~game_start | catalogue.game_starts
+
+    legal = np.empty((n, len(catalogue)), dtype=bool)
+    for i in range(0, n, CHUNK_SIZE):
+        missing = ~hand_masks[i : i + CHUNK_SIZE, None]
+        legal[i : i + CHUNK_SIZE] = (catalogue.masks & missing) == 0
+    return legal & beats
+
+
+def find_plays_batch(hands, last_plays: list[Play], game_start=False):
+    """
+    Return the legal plays of a batch of hands against their last plays.
+
+    hands is an (N, 52) array, last_plays holds one Play per hand.
+    """
+    return legal_plays(
+        boxes2masks(hands),
+        np.array([p.combination.value for p in last_plays], dtype=np.int8),
+        np.array([p.key for p in last_plays], dtype=np.int8),
+        game_start,
+    )
+
+
+def legal_indices(legal: np.ndarray) -> list[np.ndarray]:
+    """Convert each row of a legal play mask to play ids."""
+    return [np.flatnonzero(row) for row in legal]
+
+
+def plays_of(legal_row: np.ndarray) -> list[Play]:
+    """Build the Plays of one row of a legal play mask, in order."""
+    catalogue = get_catalogue()
+    return [catalogue.play(i) for i in np.flatnonzero(legal_row).tolist()]
@@ -0,0 +1,262 @@
+"""
+Bitmask card engine.
+
+A set of Cards is a single int where bit card_index() is set for every
+Card in the set. Hands and plays can then be searched, compared and
+removed with integer arithmetic instead of lists of Card objects.
+"""
+
+import functools
+import itertools
+import numpy as np
+from card import (
+    Card,
+    CardCombination,
+    Play,
+    mask2cards,
+)
+
+NUM_CARDS = 52
+NUM_RANKS = 13
+FULL_DECK: int = (1 << NUM_CARDS) - 1
+THREE_OF_DIAMONDS: int = 1 << Card("Diamonds", "3").card_index()
+
+ALL_COMBINATIONS: list[CardCombination] = [
+    CardCombination.SINGLE,
+    CardCombination.PAIR,
+    CardCombination.TRIPLE,
+    CardCombination.FULLHOUSE,
+    CardCombination.STRAIGHT,
+    CardCombination.FOUROFAKIND,
+]
+
+# Suit bits of each 4-bit rank group, lowest suit first
+SUIT_BITS: list[list[int]] = [
+    [1 << s for s in range(4) if nibble >> s & 1] for nibble in range(16)
+]
+
+# SAME_RANK[n][nibble]: every n-card subset of a rank group, in the order
+# itertools.combinations produces them from a sorted hand
+SAME_RANK: dict[int, list[list[int]]] = {
+    n: [
+        [sum(c) for c in itertools.combinations(SUIT_BITS[nibble], n)]
+        for nibble in range(16)
+    ]
+    for n in (2, 3)
+}
+
+
+def popcount(mask: int) -> int:
+    return mask.bit_count()
+
+
+def highest(mask: int) -> int:
+    """Return the card index of the best card in mask, -1 if empty."""
+    return mask.bit_length() - 1
+
+
+def rank_group(mask: int, rank: int) -> int:
+    """Return the 4-bit suit group of rank in mask."""
+    return mask >> (4 * rank) & 0xF
+
+
+def iter_indices(mask: int):
+    """Yield the card indices in mask in ascending order."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def play_key(mask: int, combination: CardCombination) -> int:
+    """Return the index of the card that decides comparisons (Play.key)."""
+    match combination:
+        case CardCombination.FULLHOUSE | CardCombination.FOUROFAKIND:
+            size = 3 if combination == CardCombination.FULLHOUSE else 4
+            for rank in range(NUM_RANKS - 1, -1, -1):
+                group = rank_group(mask, rank)
+                if popcount(group) == size:
+                    return 4 * rank + highest(group)
+            return -1
+        case _:
+            return highest(mask)
+
+
+def mask2play(
+    mask: int, combination: CardCombination, key: int | None = None
+) -> Play:
+    """Build the Play of a bitmask directly in standard order."""
+    if key is None:
+        key = play_key(mask, combination)
+    match combination:
+        case CardCombination.FULLHOUSE | CardCombination.FOUROFAKIND:
+            # The triple or quad goes last, after the pair or kicker
+            deciding = mask & 0xF << (key & ~3)
+            cards = mask2cards(mask & ~deciding) + mask2cards(deciding)
+        case _:
+            cards = mask2cards(mask)
+    return Play.canonical(cards, combination, mask, key)
+
+
+def remove(hand: int, cards: int) -> int:
+    """Remove cards from hand."""
+    return hand & ~cards
+
+
+def search_combinations(
+    last_combination: CardCombination,
+) -> list[CardCombination]:
+    """Return the combinations that may be played on last_combination."""
+    match last_combination:
+        case CardCombination.ANY:
+            return ALL_COMBINATIONS
+        case CardCombination.FOUROFAKIND:
+            return [CardCombination.FOUROFAKIND]
+        case _:
+            return [last_combination, CardCombination.FOUROFAKIND]
+
+
+def find_play_masks(
+    hand: int,
+    last_combination: CardCombination = CardCombination.ANY,
+    last_key: int = -1,
+    game_start: bool = False,
+) -> list[tuple[int, CardCombination]]:
+    """
+    Return all plays in hand that beat the last play as (mask, combination).
+
+    Plays are listed in the same order as Player.find_plays lists them.
+    If game_start is True, consider only plays with 3 of Diamonds.
+    """
+    assert last_combination != CardCombination.INVALID
+    moves: list[tuple[int, CardCombination]] = []
+    for c in search_combinations(last_combination):
+        # Only plays of the same combination have to beat last_key
+        min_key = last_key if c == last_combination else -1
+        match c:
+            case CardCombination.SINGLE:
+                moves += [
+                    (1 << i, c) for i in iter_indices(hand) if i > min_key
+                ]
+            case CardCombination.PAIR | CardCombination.TRIPLE:
+                n = 2 if c == CardCombination.PAIR else 3
+                moves += [
+                    (m, c)
+                    for m in same_rank_masks(hand, n)
+                    if highest(m) > min_key
+                ]
+            case CardCombination.FULLHOUSE:
+                # Only the triple matters, so any pair should be allowed
+                pairs = same_rank_masks(hand, 2)
+                triples = [
+                    t for t in same_rank_masks(hand, 3) if highest(t) > min_key
+                ]
+                moves += [
+                    (p | t, c)
+                    for p in pairs
+                    for t in triples
+                    if highest(p) >> 2 != highest(t) >> 2
+                ]
+            case CardCombination.STRAIGHT:
+                moves += [(m, c) for m in straight_masks(hand, min_key)]
+            case CardCombination.FOUROFAKIND:
+                moves += [
+                    (m, c)
+                    for m in four_of_a_kind_masks(hand)
+                    if play_key(m, c) > min_key
+                ]
+    if game_start:
+        moves = [m for m in moves if m[0] & THREE_OF_DIAMONDS]
+    return moves
+
+
+def same_rank_masks(hand: int, n: int) -> list[int]:
+    """Return every pair (n=2) or triple (n=3) in hand, weakest rank first."""
+    return [
+        m << (4 * rank)
+        for rank in range(NUM_RANKS)
+        for m in SAME_RANK[n][rank_group(hand, rank)]
+    ]
+
+
+def straight_masks(hand: int, min_key: int = -1) -> list[int]:
+    """
+    Return every straight in hand whose best card beats min_key.
+
+    Straights are built directly as the product of the suits held at each
+    rank of a 5 rank window, lowest starting rank first.
+    """
+    groups = [rank_group(hand, rank) for rank in range(NUM_RANKS)]
+    min_rank, min_suit = divmod(min_key, 4)
+    masks: list[int] = []
+    # Windows topping out below min_rank can never beat min_key
+    for low in range(max(0, min_rank - 4), NUM_RANKS - 4):
+        window = groups[low : low + 5]
+        if low + 4 == min_rank:
+            # Only the suits above min_suit win at the top rank
+            window[4] = window[4] >> (min_suit + 1) << (min_suit + 1)
+        if not all(window):
+            continue
+        straights = [0]
+        for i, group in enumerate(window):
+            shift = 4 * (low + i)
+            straights = [
+                m | (s << shift) for m in straights for s in SUIT_BITS[group]
+            ]
+        masks += straights
+    return masks
+
+
+def four_of_a_kind_masks(hand: int) -> list[int]:
+    """Return every four of a kind with a kicker in hand."""
+    masks: list[int] = []
+    for rank in range(NUM_RANKS):
+        if rank_group(hand, rank) != 0xF:
+            continue
+        quad = 0xF << (4 * rank)
+        masks += [quad | (1 << i) for i in iter_indices(hand & ~quad)]
+    return masks
+
+
+@functools.cache
+def combination_table() -> dict[int, tuple[CardCombination, int]]:
+    """Map the mask of every valid play to its combination and Play.key."""
+    return {m: (c, play_key(m, c)) for m, c in find_play_masks(FULL_DECK)}
+
+
+@functools.cache
+def _sorted_combinations() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return combination_table() as arrays sorted by mask."""
+    table = combination_table()
+    order = sorted(table)
+    return (
+        np.array(order, dtype=np.uint64),
+        np.array([table[m][0].value for m in order], dtype=np.int8),
+        np.array([table[m][1] for m in order], dtype=np.int8),
+    )
+
+
+def classify(mask: int) -> tuple[CardCombination, int]:
+    """
+    Return the combination and Play.key of a bitmask play.
+
+    Masks that are not a valid combination give (INVALID, -1).
+    """
+    return combination_table().get(mask, (CardCombination.INVALID, -1))
+
+
+def classify_many(masks) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Classify an array of bitmask plays at once.
+
+    Return arrays of CardCombination values and Play.keys, using
+    CardCombination.INVALID.value and -1 for invalid masks.
+    """
+    sorted_masks, combinations, keys = _sorted_combinations()
+    masks = np.asarray(masks, dtype=np.uint64)
+    i = np.searchsorted(sorted_masks, masks).clip(max=len(sorted_masks) - 1)
+    found = sorted_masks[i] == masks
+    return (
+        np.where(found, combinations[i], CardCombination.INVALID.value),
+        np.where(found, keys[i], -1),
+    )
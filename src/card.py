@@ -28,9 +28,13 @@ class Card:
     """
     Represent a card with a suit and rank.
 
-    Can be compared to other Cards.
+    There is exactly one instance per card: Card(suit, rank) returns the
+    interned instance from the card table, which carries its precomputed
+    indices. Can be compared to other Cards.
     """
 
+    __slots__ = ("suit", "rank", "index", "rank_idx", "suit_idx")
+
     suits = {"Diamonds": 0, "Clubs": 1, "Hearts": 2, "Spades": 3}
     ranks = {
         "3": 0,
@@ -47,10 +51,30 @@ class Card:
         "A": 11,
         "2": 12,
     }
-
-    def __init__(self, suit: str, rank: str):
-        self.suit = suit
-        self.rank = rank
+    _table: dict[tuple[str, str], "Card"] = {}
+
+    suit: str
+    rank: str
+    index: int
+    rank_idx: int
+    suit_idx: int
+
+    def __new__(cls, suit: str, rank: str):
+        return cls._table[(suit, rank)]
+
+    @classmethod
+    def _intern(cls, suit: str, rank: str) -> "Card":
+        card = object.__new__(cls)
+        card.suit = suit
+        card.rank = rank
+        card.rank_idx = Card.ranks[rank]
+        card.suit_idx = Card.suits[suit]
+        card.index = 4 * card.rank_idx + card.suit_idx
+        cls._table[(suit, rank)] = card
+        return card
+
+    def __reduce__(self):
+        return Card, (self.suit, self.rank)
 
     def __repr__(self):
         symbols = [
@@ -59,35 +83,35 @@ class Card:
             f"{Color.TEXT_RED_BRIGHT.value}♥",
             f"{Color.TEXT_BLACK.value}♠",
         ]
-        emoji = symbols[Card.suits[self.suit]]
+        emoji = symbols[self.suit_idx]
         return f"{Color.BG_WHITE_BRIGHT.value}{self.rank}{emoji}{Color.RESET.value}"
 
     def __lt__(self, other: "Card"):
-        return (self.rank_index(), self.suit_index()) < (
-            other.rank_index(),
-            other.suit_index(),
-        )
+        return self.index < other.index
 
     def __gt__(self, other: "Card"):
-        return (self.rank_index(), self.suit_index()) > (
-            other.rank_index(),
-            other.suit_index(),
-        )
+        return self.index > other.index
 
     def __eq__(self, other):
-        return self.rank == other.rank and self.suit == other.suit
+        return self is other
 
     def __hash__(self):
-        return hash((self.rank, self.suit))
+        return self.index
 
     def rank_index(self):
-        return Card.ranks[self.rank]
+        return self.rank_idx
 
     def suit_index(self):
-        return Card.suits[self.suit]
+        return self.suit_idx
 
     def card_index(self) -> int:
-        return 4 * Card.ranks[self.rank] + Card.suits[self.suit]
+        return self.index
+
+
+# The card table: every Card, ordered by card_index()
+CARDS: tuple[Card, ...] = tuple(
+    Card._intern(suit, rank) for rank in Card.ranks for suit in Card.suits
+)
 
 
 @total_ordering
@@ -119,69 +143,42 @@ def __repr__(self):
 
 
 def is_single(cards: Cards) -> bool:
-    return len(cards) == 1
+    return identify_combination(cards) == CardCombination.SINGLE
 
 
 def is_pair(cards: Cards) -> bool:
-    return len(cards) == 2 and cards[0].rank == cards[1].rank
+    return identify_combination(cards) == CardCombination.PAIR
 
 
 def is_triple(cards: Cards) -> bool:
-    return len(cards) == 3 and len(set(card.rank for card in cards)) == 1
+    return identify_combination(cards) == CardCombination.TRIPLE
 
 
 def is_straight(cards: Cards) -> bool:
-    if len(cards) != 5:
-        return False
-    sorted_cards = sorted(cards, key=lambda c: c.rank_index())
-    for i in range(4):
-        if (
-            sorted_cards[i].rank_index() + 1
-            != sorted_cards[i + 1].rank_index()
-        ):
-            return False
-    return True
+    return identify_combination(cards) == CardCombination.STRAIGHT
 
 
 def is_full_house(cards: Cards) -> bool:
-    rank_counts = Counter(card.rank for card in cards)
-    return sorted(rank_counts.values()) == [2, 3]
+    return identify_combination(cards) == CardCombination.FULLHOUSE
 
 
 def is_four_of_a_kind(cards: Cards) -> bool:
-    rank_counts = Counter(card.rank for card in cards)
-    return 4 in rank_counts.values() and len(cards) == 5
+    return identify_combination(cards) == CardCombination.FOUROFAKIND
 
 
 def is_valid_combination(cards: Cards) -> bool:
-    return (
-        is_single(cards)
-        or is_pair(cards)
-        or is_triple(cards)
-        or is_straight(cards)
-        or is_full_house(cards)
-        or is_four_of_a_kind(cards)
-    )
+    return identify_combination(cards) != CardCombination.INVALID
 
 
 def identify_combination(cards: Cards) -> CardCombination:
-    match len(cards):
-        case 1:
-            return CardCombination.SINGLE
-        case 2:
-            if is_pair(cards):
-                return CardCombination.PAIR
-        case 3:
-            if is_triple(cards):
-                return CardCombination.TRIPLE
-        case 5:
-            if is_four_of_a_kind(cards):
-                return CardCombination.FOUROFAKIND
-            if is_straight(cards):
-                return CardCombination.STRAIGHT
-            if is_full_house(cards):
-                return CardCombination.FULLHOUSE
-    return CardCombination.INVALID
+    """Look up the combination of cards in the precomputed table."""
+    from bitmask import classify
+
+    mask = cards2mask(cards)
+    # Repeated Cards never form a valid combination
+    if mask.bit_count() != len(cards):
+        return CardCombination.INVALID
+    return classify(mask)[0]
 
 
 class Play:
@@ -192,9 +189,11 @@ class Play:
     Can be compared with other Plays.
     """
 
+    __slots__ = ("cards", "combination", "mask", "key")
+
     def __init__(
         self,
-        cards: Cards = [],
+        cards: Cards | None = None,
         combination: CardCombination = CardCombination.ANY,
     ):
         """
@@ -205,11 +204,15 @@ class Play:
         Pairs and Straights: only compare just the best card.
         Full Houses and Four of a Kinds: compare ranks of triple or quad.
         """
-        self.cards: Cards = cards
+        self.cards: Cards = [] if cards is None else cards
         self.combination: CardCombination = combination
 
         match self.combination:
-            case CardCombination.PAIR | CardCombination.STRAIGHT:
+            case (
+                CardCombination.PAIR
+                | CardCombination.TRIPLE
+                | CardCombination.STRAIGHT
+            ):
                 self.cards = sorted(self.cards)
             case CardCombination.FULLHOUSE | CardCombination.FOUROFAKIND:
                 freq = Counter([c.rank for c in self.cards])
@@ -223,6 +226,29 @@ class Play:
                     self.cards[2:] = sorted(self.cards[2:])
             case CardCombination.INVALID:
                 assert False, f"Invalid play detected: {self}"
+        self.mask: int = cards2mask(self.cards)
+        # Index of the card that decides comparisons, -1 if there is none
+        self.key: int = self.cards[-1].card_index() if len(self.cards) else -1
+
+    @classmethod
+    def canonical(
+        cls,
+        cards: Cards,
+        combination: CardCombination,
+        mask: int,
+        key: int,
+    ) -> "Play":
+        """
+        Build a Play from cards already in standard order.
+
+        Skips sorting; mask and key must match cards.
+        """
+        play = object.__new__(cls)
+        play.cards = cards
+        play.combination = combination
+        play.mask = mask
+        play.key = key
+        return play
 
     def simplify_play(self) -> str:
         s = ""
@@ -241,42 +267,39 @@ class Play:
 
     def __lt__(self, other: "Play"):
         """Determine if self's Play < other's Play."""
-        # All plays are better than ANY
-        if (
-            self.combination == CardCombination.ANY
-            and other.combination != CardCombination.ANY
-        ):
-            return True
-        elif (
-            self.combination != CardCombination.ANY
-            and other.combination == CardCombination.ANY
-        ):
-            return False
-        # Four of a kinds beat all non four of a kinds
-        if (
-            self.combination != CardCombination.FOUROFAKIND
-            and other.combination == CardCombination.FOUROFAKIND
-        ):
-            return True
-        elif (
-            self.combination == CardCombination.FOUROFAKIND
-            and other.combination != CardCombination.FOUROFAKIND
-        ):
-            return False
-        # At this point there are no more special rules
-        if self.combination != other.combination:
-            return False
-        # Normal same combination compare
-        return self.cards[-1] < other.cards[-1]
+        return beats(other.combination, other.key, self.combination, self.key)
 
     def __eq__(self, other) -> bool:
         return (
-            self.cards == other.cards and self.combination == other.combination
+            self.mask == other.mask and self.combination == other.combination
         )
 
     def __hash__(self) -> int:
-        x = sum(hash(c) for c in self.cards)
-        return x * self.combination.value
+        return hash((self.mask, self.combination.value))
+
+
+def beats(
+    combination: CardCombination,
+    key: int,
+    last_combination: CardCombination,
+    last_key: int,
+) -> bool:
+    """
+    Determine if a play beats the last play.
+
+    Plays are given as their combination and the index of their deciding
+    card (Play.key), so this works on bitmask plays as well as Plays.
+    """
+    # All plays are better than ANY
+    if last_combination == CardCombination.ANY:
+        return combination != CardCombination.ANY
+    if combination == CardCombination.ANY:
+        return False
+    # Four of a kinds beat all non four of a kinds
+    if combination != last_combination:
+        return combination == CardCombination.FOUROFAKIND
+    # Normal same combination compare
+    return key > last_key
 
 
 class Deck:
@@ -286,11 +309,14 @@ class Deck:
     Initializes already shuffled.
     """
 
+    # Unshuffled order, so seeded decks deal the same hands as ever
+    ordered: tuple[Card, ...] = tuple(
+        Card(suit, rank)
+        for suit, rank in itertools.product(Card.suits, Card.ranks)
+    )
+
     def __init__(self, seed: int | None = None):
-        self.cards = [
-            Card(suit, rank)
-            for suit, rank in itertools.product(Card.suits, Card.ranks)
-        ]
+        self.cards = list(Deck.ordered)
         self.random = random.Random(seed)
         self.random.shuffle(self.cards)
 
@@ -308,23 +334,52 @@ def cards2box(cards: Cards):
 
 def box2cards(box) -> Cards:
     """Convert boolean list to Cards."""
+    return [CARDS[i] for i in np.flatnonzero(box)]
+
+
+def cards2mask(cards: Cards) -> int:
+    """Convert Cards to a bitmask where bit card_index() is set."""
+    mask = 0
+    for c in cards:
+        mask |= 1 << c.card_index()
+    return mask
+
+
+def mask2cards(mask: int) -> Cards:
+    """Convert a bitmask to sorted Cards."""
     cards: Cards = []
-    suits = [s for s in Card.suits.keys()]
-    ranks = [r for r in Card.ranks.keys()]
-    for i, c in enumerate(box):
-        if c:
-            cards.append(Card(suits[i % 4], ranks[i // 4]))
+    while mask:
+        low = mask & -mask
+        cards.append(CARDS[low.bit_length() - 1])
+        mask ^= low
     return cards
 
 
+def box2mask(box) -> int:
+    """Convert boolean list to bitmask."""
+    packed = np.packbits(np.asarray(box, dtype=bool), bitorder="little")
+    return int.from_bytes(packed.tobytes(), "little")
+
+
+def mask2box(mask: int):
+    """Convert bitmask to boolean list."""
+    packed = np.frombuffer(mask.to_bytes(7, "little"), dtype=np.uint8)
+    return np.unpackbits(packed, bitorder="little")[:52].astype(np.int8)
+
+
+# Discrete actions: 52 * combination + key for plays, then PASS
+PASS_ACTION = 52 * 6
+# play2discrete adds Play.key, which is -1 for PASS and ANY
+DISCRETE_OFFSETS: dict[CardCombination, int] = {
+    c: 52 * c.value for c in CardCombination
+} | {
+    CardCombination.PASS: PASS_ACTION + 1,
+    CardCombination.ANY: PASS_ACTION + 2,
+}
+
+
 def play2discrete(play: Play) -> int:
-    match play.combination:
-        case CardCombination.PASS:
-            return 52 * 6
-        case CardCombination.ANY:
-            return 52 * 6 + 1
-        case _:
-            return play.cards[-1].card_index() + 52 * play.combination.value
+    return DISCRETE_OFFSETS[play.combination] + play.key
 
 
 def discrete2playlike(n: int) -> tuple[Card | None, CardCombination]:
@@ -333,9 +388,5 @@ def discrete2playlike(n: int) -> tuple[Card | None, CardCombination]:
         return None, CardCombination.PASS
     c = n // 52
     k = n - (52 * c)
-    suit = k % 4
-    rank = k // 4
 
-    return Card(
-        list(Card.suits)[suit], list(Card.ranks)[rank]
-    ), CardCombination(c)
+    return CARDS[k], CardCombination(c)
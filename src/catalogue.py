@@ -0,0 +1,238 @@
+"""
+Global catalogue of every concrete play.
+
+Each of the 13766 plays of the full deck gets a stable id: its position in
+the order Player.find_plays lists the plays of the full deck. The
+catalogue is built once, cached to disk next to this file and loaded
+lazily by get_catalogue().
+"""
+
+import functools
+import os
+import tempfile
+import numpy as np
+from card import PASS_ACTION, CardCombination, Play
+from bitmask import (
+    FULL_DECK,
+    NUM_CARDS,
+    NUM_RANKS,
+    THREE_OF_DIAMONDS,
+    find_play_masks,
+    mask2play,
+    play_key,
+)
+
+CATALOGUE_VERSION = 1
+CACHE_PATH = os.path.join(os.path.dirname(__file__), "catalogue.npz")
+
+NUM_PLAYS = 13766
+PASS_ID = NUM_PLAYS
+ANY_ID = NUM_PLAYS + 1
+
+
+class PlayCatalogue:
+    """Every play of the full deck as parallel arrays indexed by play id."""
+
+    def __init__(
+        self,
+        masks: np.ndarray,
+        combinations: np.ndarray,
+        keys: np.ndarray,
+    ):
+        assert len(masks) == NUM_PLAYS
+        self.masks: np.ndarray = masks  # uint64 bitmask of the cards
+        self.combinations: np.ndarray = combinations  # CardCombination value
+        self.keys: np.ndarray = keys  # Play.key, the comparison rank
+        self.game_starts: np.ndarray = (
+            masks & np.uint64(THREE_OF_DIAMONDS)
+        ) != 0
+        self.ids: dict[int, int] = {m: i for i, m in enumerate(masks.tolist())}
+
+    def __len__(self) -> int:
+        return NUM_PLAYS
+
+    @classmethod
+    def build(cls) -> "PlayCatalogue":
+        plays = find_play_masks(FULL_DECK)
+        return cls(
+            np.array([m for m, _ in plays], dtype=np.uint64),
+            np.array([c.value for _, c in plays], dtype=np.int8),
+            np.array([play_key(m, c) for m, c in plays], dtype=np.int8),
+        )
+
+    @classmethod
+    def load(cls, path: str = CACHE_PATH) -> "PlayCatalogue":
+        with np.load(path) as f:
+            assert int(f["version"]) == CATALOGUE_VERSION, "Stale catalogue"
+            return cls(f["masks"], f["combinations"], f["keys"])
+
+    def save(self, path: str = CACHE_PATH):
+        """
+        Write to a temporary file moved into place, so readers never see
+        a partly written catalogue.
+        """
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(os.path.abspath(path)),
+            suffix=".npz",
+            delete=False,
+        ) as f:
+            np.savez(
+                f,
+                version=CATALOGUE_VERSION,
+                masks=self.masks,
+                combinations=self.combinations,
+                keys=self.keys,
+            )
+        try:
+            os.replace(f.name, path)
+        except OSError:
+            os.remove(f.name)
+            raise
+
+    def id_of(self, play: Play) -> int:
+        match play.combination:
+            case CardCombination.PASS:
+                return PASS_ID
+            case CardCombination.ANY:
+                return ANY_ID
+            case _:
+                return self.ids[play.mask]
+
+    def play(self, play_id: int) -> Play:
+        if play_id == PASS_ID:
+            return Play([], CardCombination.PASS)
+        if play_id == ANY_ID:
+            return Play()
+        return mask2play(
+            int(self.masks[play_id]),
+            CardCombination(self.combinations[play_id]),
+            int(self.keys[play_id]),
+        )
+
+    @functools.cached_property
+    def discrete_ids(self) -> np.ndarray:
+        """Return play2discrete of every play."""
+        return 52 * self.combinations.astype(np.int64) + self.keys
+
+    @functools.cached_property
+    def mask_actions(self) -> dict[int, int]:
+        """Map the mask of every play to its discrete action, 0 to PASS."""
+        actions = dict(zip(self.masks.tolist(), self.discrete_ids.tolist()))
+        actions[0] = PASS_ACTION
+        return actions
+
+    @functools.cached_property
+    def boxes(self) -> np.ndarray:
+        """Return the (NUM_PLAYS, 52) boolean cards of every play."""
+        packed = self.masks.astype("<u8").view(np.uint8).reshape(-1, 8)
+        return np.unpackbits(packed, axis=1, bitorder="little")[
+            :, :NUM_CARDS
+        ].astype(bool)
+
+    @functools.cached_property
+    def rank_counts(self) -> np.ndarray:
+        """Return how many cards of each rank every play has."""
+        return self.boxes.reshape(-1, NUM_RANKS, 4).sum(axis=2, dtype=np.int8)
+
+    @functools.cached_property
+    def strengths(self) -> np.ndarray:
+        """
+        Return the position of every play when sorted by combination, then
+        key, ties by id.
+
+        This is the order Player.iter_plays yields the plays of a hand in.
+        """
+        order = np.lexsort(
+            (np.arange(NUM_PLAYS), self.keys, self.combinations)
+        )
+        return order.argsort()
+
+    @functools.cached_property
+    def beats_table(self) -> np.ndarray:
+        """
+        Return which plays beat each possible last play.
+
+        Plays compare by combination and key only, so row
+        52 * combination + key covers every last play with that
+        combination and key. The last row is for ANY.
+        """
+        combinations = np.append(
+            np.repeat(np.arange(6, dtype=np.int8), 52),
+            CardCombination.ANY.value,
+        )[:, None]
+        keys = np.append(np.tile(np.arange(52), 6), -1)[:, None]
+        quad = CardCombination.FOUROFAKIND.value
+        return (
+            # All plays are better than ANY
+            (combinations == CardCombination.ANY.value)
+            # Four of a kinds beat all non four of a kinds
+            | ((self.combinations == quad) & (combinations != quad))
+            # Normal same combination compare
+            | ((self.combinations == combinations) & (self.keys > keys))
+        )
+
+    def beats_rows(self, last_combinations, last_keys) -> np.ndarray:
+        """Return beats_table rows for arrays of last plays."""
+        last_combinations = np.asarray(last_combinations, dtype=np.int64)
+        rows = np.where(
+            last_combinations == CardCombination.ANY.value,
+            len(self.beats_table) - 1,
+            52 * last_combinations + last_keys,
+        )
+        return self.beats_table[rows]
+
+    def beats_row_ids(self, last_play_ids) -> np.ndarray:
+        """Return the beats_table rows of an array of last play ids."""
+        last_play_ids = np.asarray(last_play_ids)
+        start = last_play_ids == ANY_ID
+        ids = np.where(start, 0, last_play_ids)
+        return np.where(
+            start,
+            len(self.beats_table) - 1,
+            52 * self.combinations[ids].astype(np.int64) + self.keys[ids],
+        )
+
+    def beats(self, last_play_id: int) -> np.ndarray:
+        """Return a boolean vector of the plays that beat a last play."""
+        if last_play_id == ANY_ID:
+            return self.beats_table[-1]
+        return self.beats_table[
+            52 * int(self.combinations[last_play_id])
+            + int(self.keys[last_play_id])
+        ]
+
+    def legal_mask(
+        self, hand_mask: int, last_play_id: int, game_start: bool = False
+    ) -> np.ndarray:
+        """
+        Return a boolean vector over the catalogue of the legal plays.
+
+        These are the plays in hand_mask that beat the last play. If
+        game_start is True, consider only plays with 3 of Diamonds.
+        """
+        legal = (self.masks & np.uint64(FULL_DECK & ~hand_mask)) == 0
+        legal &= self.beats(last_play_id)
+        if game_start:
+            legal &= self.game_starts
+        return legal
+
+
+def load_or_build(path: str = CACHE_PATH) -> PlayCatalogue:
+    """Load the catalogue at path, building and saving it if that fails."""
+    try:
+        return PlayCatalogue.load(path)
+    except Exception:
+        # Missing, stale or corrupt, build it again
+        pass
+    catalogue = PlayCatalogue.build()
+    try:
+        catalogue.save(path)
+    except OSError:
+        pass
+    return catalogue
+
+
+@functools.cache
+def get_catalogue() -> PlayCatalogue:
+    """Load the catalogue from disk, building and caching it if needed."""
+    return load_or_build()
@@ -0,0 +1,231 @@
+"""
+Observation encoders for RLAgent and BigTwoEnv.
+
+An encoder maps an observation, the discrete last play and the hand box
+BigTwoEnv returns, to an int state key for the Q table. Coarser encoders
+drop the suits or most of the hand, so many observations share a key and
+the agent revisits its states far more often. They key the actions of
+those states without suits too, so values carry over between the deals
+that share a state.
+"""
+
+from bisect import bisect_right
+import functools
+import itertools
+from typing import Callable
+import numpy as np
+from bitmask import FULL_DECK
+from card import PASS_ACTION, box2mask
+from catalogue import get_catalogue
+from qtable import LAST_PLAY_BITS, state_key
+
+# Bits of the last play's combination * 13 + rank
+LAST_RANK_BITS = 7
+# Bits of the count of cards of each rank
+RANK_COUNT_BITS = 3
+RANK_WEIGHTS = 1 << RANK_COUNT_BITS * np.arange(13, dtype=np.int64)
+
+# Every relabelling of the suits, SUIT_PERMUTATIONS[i][suit] is the new suit
+SUIT_PERMUTATIONS: list[tuple[int, ...]] = list(
+    itertools.permutations(range(4))
+)
+# The cards of each suit as a bitmask
+SUIT_MASKS: list[int] = [
+    sum(1 << (4 * rank + suit) for rank in range(13)) for suit in range(4)
+]
+# KEY_PERMUTATIONS[i][last_play] relabels the key card of a discrete last
+# play by SUIT_PERMUTATIONS[i]
+KEY_PERMUTATIONS: list[list[int]] = [
+    [a - a % 4 + p[a % 4] for a in range(PASS_ACTION)]
+    for p in SUIT_PERMUTATIONS
+]
+
+
+def last_play_rank(last_play: int) -> int:
+    """
+    Return combination * 13 + rank of a discrete last play, dropping the
+    suit of its key card. PASS and ANY follow the plays.
+    """
+    if last_play >= PASS_ACTION:
+        return 6 * 13 + last_play - PASS_ACTION
+    return last_play // 52 * 13 + last_play % 52 // 4
+
+
+def play_rank(mask: int) -> int:
+    """Return last_play_rank of the play with the cards of mask, 0 to PASS."""
+    return last_play_rank(get_catalogue().mask_actions[mask])
+
+
+class ObservationEncoder:
+    """Key observations by the exact hand and last play, like state_key."""
+
+    # Every key is below this
+    size: int = 1 << (52 + LAST_PLAY_BITS)
+
+    def encode(self, last_play: int, hand) -> int:
+        return state_key(last_play, hand)
+
+    def __call__(self, obs) -> int:
+        # BigTwoEnv with an encoder returns keys already
+        if isinstance(obs, (int, np.integer)):
+            return int(obs)
+        return self.encode(obs[0], obs[1])
+
+    # Whether actions are keyed differently from their discrete action
+    relabels: bool = False
+
+    def action_keys(self, obs) -> Callable[[int], int]:
+        """
+        Return a function from the cards of a play, 0 for PASS, to its
+        action as keyed in the state of obs.
+        """
+        return get_catalogue().mask_actions.__getitem__
+
+    def legal_keys(self, obs) -> set[int]:
+        """
+        Return the keys of the actions legal in obs, past the first turn of
+        the game. Passing is always legal.
+        """
+        assert not isinstance(
+            obs, (int, np.integer)
+        ), "Legal actions are found from the hand, they need raw observations"
+        last_play, hand = obs
+        catalogue = get_catalogue()
+        fits = (catalogue.masks & np.uint64(FULL_DECK & ~box2mask(hand))) == 0
+        # Row 52 * combination + key is the discrete last play, -1 is ANY
+        beats = catalogue.beats_table[
+            -1 if last_play >= PASS_ACTION else int(last_play)
+        ]
+        action_key = self.action_keys(obs)
+        return {action_key(0)} | {
+            action_key(m) for m in catalogue.masks[fits & beats].tolist()
+        }
+
+
+class RankEncoder(ObservationEncoder):
+    """Key observations by how many cards of each rank the hand has and
+    the combination and rank of the last play, ignoring suits. Actions are
+    keyed by their combination and key rank, see play_rank."""
+
+    size = 1 << (13 * RANK_COUNT_BITS + LAST_RANK_BITS)
+
+    def encode(self, last_play: int, hand) -> int:
+        counts = np.asarray(hand, dtype=np.int64).reshape(13, 4).sum(axis=1)
+        return int(counts @ RANK_WEIGHTS) << LAST_RANK_BITS | last_play_rank(
+            last_play
+        )
+
+    relabels = True
+
+    def action_keys(self, obs) -> Callable[[int], int]:
+        return play_rank
+
+
+class HandSizeEncoder(ObservationEncoder):
+    """
+    Key observations by a bucket of the hand size and the combination and
+    rank of the last play only, and actions by their combination and key
+    rank like RankEncoder.
+
+    buckets are the smallest hand size of each bucket.
+    """
+
+    def __init__(self, buckets: tuple[int, ...] = (1, 4, 7, 10)):
+        self.buckets = buckets
+        self.size = (len(buckets) + 1) << LAST_RANK_BITS
+
+    def encode(self, last_play: int, hand) -> int:
+        bucket = bisect_right(self.buckets, int(np.count_nonzero(hand)))
+        return bucket << LAST_RANK_BITS | last_play_rank(last_play)
+
+    relabels = True
+
+    def action_keys(self, obs) -> Callable[[int], int]:
+        return play_rank
+
+
+def permute_suits(mask: int, permutation: tuple[int, ...]) -> int:
+    """Relabel the suits of the cards in mask."""
+    permuted = 0
+    for suit, new_suit in enumerate(permutation):
+        permuted |= (mask & SUIT_MASKS[suit]) >> suit << new_suit
+    return permuted
+
+
+def canonicalise(last_play: int, hand_mask: int) -> tuple[int, int]:
+    """
+    Return the smallest state key that relabelling the suits of a hand and
+    last play gives, and the index of that relabelling.
+
+    Suits are only relabelled in ways that keep every play of the hand
+    beating the last play if and only if it did: a suit held at the rank
+    of the last play's key card stays on the same side of that card's
+    suit. Whether the hand has the 3 of Diamonds is kept when it may have
+    to start the game.
+    Other tie-breaks between suits are ignored.
+    """
+    # (suit, whether it is below the key suit) of each suit that must stay
+    # on its side of the key suit
+    sides: list[tuple[int, bool]] = []
+    key_suit = 0
+    if last_play < PASS_ACTION:
+        key_rank, key_suit = divmod(last_play % 52, 4)
+        held = hand_mask >> (4 * key_rank) & 0xF
+        sides = [(s, s < key_suit) for s in range(4) if held >> s & 1]
+    game_start = last_play >= PASS_ACTION
+    # The cards of each suit, shifted to the diamonds
+    suits = [(hand_mask & SUIT_MASKS[s]) >> s for s in range(4)]
+    # Leaving the suits as they are always qualifies
+    best = (hand_mask << LAST_PLAY_BITS | last_play, 0)
+    for i, p in enumerate(SUIT_PERMUTATIONS):
+        if any((p[s] < p[key_suit]) != below for s, below in sides):
+            continue
+        hand = suits[0] << p[0] | suits[1] << p[1] | suits[2] << p[2]
+        hand |= suits[3] << p[3]
+        if game_start and (hand ^ hand_mask) & 1:
+            continue
+        if last_play < PASS_ACTION:
+            last_play_key = KEY_PERMUTATIONS[i][last_play]
+        else:
+            last_play_key = last_play
+        key = hand << LAST_PLAY_BITS | last_play_key
+        if key < best[0]:
+            best = (key, i)
+    return best
+
+
+class SuitEncoder(ObservationEncoder):
+    """
+    Key observations by the canonical relabelling of their suits, see
+    canonicalise, and relabel the cards of their plays to match.
+
+    The last cache_size canonicalisations are cached.
+    """
+
+    def __init__(self, cache_size: int = 1 << 16):
+        self._canonicalise = functools.lru_cache(maxsize=cache_size)(
+            canonicalise
+        )
+
+    def encode(self, last_play: int, hand) -> int:
+        return self._canonicalise(int(last_play), box2mask(hand))[0]
+
+    relabels = True
+
+    def action_keys(self, obs) -> Callable[[int], int]:
+        # Plays are relabelled whole, their key card may change
+        assert not isinstance(
+            obs, (int, np.integer)
+        ), "SuitEncoder relabels actions by the hand, it needs raw observations"
+        _, i = self._canonicalise(int(obs[0]), box2mask(obs[1]))
+        permutation = SUIT_PERMUTATIONS[i]
+        mask_actions = get_catalogue().mask_actions
+        return lambda mask: mask_actions[permute_suits(mask, permutation)]
+
+
+ENCODERS: dict[str, type[ObservationEncoder]] = {
+    "exact": ObservationEncoder,
+    "ranks": RankEncoder,
+    "hand_size": HandSizeEncoder,
+    "suits": SuitEncoder,
+}
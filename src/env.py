@@ -3,20 +3,29 @@ from typing import Optional
 import logging
 import gymnasium as gym
 from gymnasium import spaces
-from card import Color, CardCombination, Play, cards2box
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+from card import PASS_ACTION, Color, CardCombination, Play, cards2box
+from catalogue import ANY_ID, NUM_PLAYS, PASS_ID, get_catalogue
+from encoders import ObservationEncoder
 from main import BigTwoGame
+from simulator import POLICIES, BatchedBigTwoSimulator
 from player import *
 
 LOGGER = logging.getLogger(__name__)
 
-# 13766 with suits, 360 without
-num_plays = 13766 + 1
+# 13766 with suits, 360 without, plus pass
+num_plays = NUM_PLAYS + 1
 num_cards = 52
 
 
 class BigTwoEnv(gym.Env):
-    def __init__(self, game: BigTwoGame) -> None:
+    def __init__(
+        self, game: BigTwoGame, encoder: ObservationEncoder | None = None
+    ) -> None:
+        """With an encoder, observations are its state keys."""
         self.game = game
+        self.encoder = encoder
         self.num_agents: int = len(game.players)
         self.rl_agentid: int = next(
             i for i, p in enumerate(game.players) if isinstance(p, RLAgent)
@@ -30,6 +39,12 @@ class BigTwoEnv(gym.Env):
                 spaces.Box(low=0, high=1, shape=(num_cards,), dtype=np.int8),
             )
         )
+        if encoder is not None:
+            self.observation_space = spaces.Discrete(encoder.size)
+        # The RLAgent's plays on its current turn
+        self.turn_context: TurnContext | None = None
+        # Discrete action -> the first of its plays in find_plays order
+        self.legal_plays: dict[int, Play] = {}
 
         """
         observation = {
@@ -39,14 +54,51 @@ class BigTwoEnv(gym.Env):
         """
 
     def _get_obs(self):
-        return (
+        obs = (
             play2discrete(self.game.last_play),
             cards2box(self.game.players[self.rl_agentid].hand),
         )
+        return obs if self.encoder is None else self.encoder(obs)
+
+    def full_action_mask(self):
+        """
+        Return the legal plays of the RLAgent over the play catalogue.
+
+        Index i is play id i of the catalogue, the last index is PASS.
+        """
+        catalogue = get_catalogue()
+        mask = np.ones(num_plays, dtype=bool)
+        mask[:PASS_ID] = catalogue.legal_mask(
+            cards2mask(self.game.players[self.rl_agentid].hand),
+            catalogue.id_of(self.game.last_play),
+            self.game.turns == 0,
+        )
+        return mask
+
+    def _find_legal_plays(self):
+        """Find the RLAgent's plays once per turn, none once the game ends."""
+        game = self.game
+        self.turn_context = None
+        self.legal_plays = {}
+        if game.winner is not None:
+            return
+        self.turn_context = game.turn_context()
+        # Passing is always allowed
+        self.legal_plays[PASS_ACTION] = Play([], CardCombination.PASS)
+        mask_actions = get_catalogue().mask_actions
+        for play in reversed(self.turn_context.available_plays):
+            self.legal_plays[mask_actions[play.mask]] = play
+
+    def action_mask(self) -> np.ndarray:
+        """Return which discrete actions are legal, as Discrete.sample takes."""
+        # One entry per action of action_space, PASS_ACTION is the last
+        mask = np.zeros(PASS_ACTION + 1, dtype=np.int8)
+        mask[list(self.legal_plays)] = 1
+        return mask
 
     def _get_info(self):
         # TODO: Fix for round win
-        return {"win_bonus": 5}
+        return {"win_bonus": 5, "action_mask": self.action_mask()}
 
     def _new_round(self):
         """Resets last play and passes."""
@@ -54,11 +106,12 @@ class BigTwoEnv(gym.Env):
         self.game.last_play = Play()
         # Reset passes
         self.game.passes = [False] * self.num_agents
-        LOGGER.info(
-            "%sNew round%s",
-            Color.BG_YELLOW_BRIGHT.value,
-            Color.RESET.value,
-        )
+        if LOGGER.isEnabledFor(logging.INFO):
+            LOGGER.info(
+                "%sNew round%s",
+                Color.BG_YELLOW_BRIGHT.value,
+                Color.RESET.value,
+            )
 
     def reset(
         self, *, seed: Optional[int] = None, options: Optional[dict] = None
@@ -69,12 +122,14 @@ class BigTwoEnv(gym.Env):
         while self.game.current_player_index != self.rl_agentid:
             self.game.play_turn()
             self.game.next_player()
+        self._find_legal_plays()
         return self._get_obs(), self._get_info()
 
     def step(self, action):
-        assert self.action_space.contains(action)
         """
-        Accepts an action
+        Accepts an action, played as the play the RLAgent chose for it in
+        turn_context, else the first of its plays in find_plays order.
+        info["action_mask"] holds the legal actions.
 
         Returns a tuple[observation (ObsType), reward (SupportsFloat), terminated (bool), truncated (bool), info (dict)]
         """
@@ -82,71 +137,234 @@ class BigTwoEnv(gym.Env):
         # TODO: Tune this function
         # Give bonus for RLAgent playing more cards
 
-        current_player_index: int = self.game.current_player_index
-        current_player = self.game.players[current_player_index]
+        game = self.game
+        verbose = LOGGER.isEnabledFor(logging.INFO)
+        current_player_index: int = game.current_player_index
+        current_player = game.players[current_player_index]
         assert isinstance(current_player, RLAgent)
-        LOGGER.info("%s hand: %s", current_player.name, current_player.hand)
-        ctx = current_player.find_plays(
-            self.game.last_play, self.game.turns == 0
-        )
-        ctx.available_plays.append(Play([], CardCombination.PASS))
-        play: Play = current_player.make_play(ctx, self._get_obs())
+        if verbose:
+            LOGGER.info(
+                "%s hand: %s", current_player.name, current_player.hand
+            )
+        play = self.legal_plays.get(action)
+        assert play is not None, f"Illegal action {action}"
+        # Play what the agent chose this turn if it is the action's play
+        chosen = game.turn_context().chosen
+        if chosen is not None and play2discrete(chosen) == action:
+            play = chosen
         reward = len(play.cards)
         if play.combination != CardCombination.PASS:
             # Remove cards from that player's hand
-            for c in play.cards:
-                current_player.hand.remove(c)
+            game.remove_cards(current_player_index, play)
 
             # Set new last Play
-            self.game.last_play = play
+            game.last_play = play
 
             # Set new last player
-            self.game.last_player = current_player_index
+            game.last_player = current_player_index
 
             # Update passes
-            self.game.passes[current_player_index] = False
+            game.passes[current_player_index] = False
 
-            LOGGER.info("%s plays %s", current_player.name, play)
+            if verbose:
+                LOGGER.info("%s plays %s", current_player.name, play)
         else:
             # State doesn't change on PASS. Just update passes.
-            self.game.passes[current_player_index] = True
-            LOGGER.info("%s passes", current_player.name)
+            game.passes[current_player_index] = True
+            if verbose:
+                LOGGER.info("%s passes", current_player.name)
 
         # Increments turn count
-        self.game.turns += 1
+        game.turns += 1
 
         # Check for game end
 
-        if self.game.is_game_over():
+        if game.winner is not None:
             if current_player_index == self.rl_agentid:
                 reward += 100
-            LOGGER.info("%s has won the game!", current_player.name)
+            if verbose:
+                LOGGER.info("%s has won the game!", current_player.name)
 
         else:
             i = 1
-            while not self.game.is_game_over() and i < self.num_agents:
-                self.game.next_player()
-                if self.game.check_other_passes():
+            while game.winner is None and i < self.num_agents:
+                game.next_player()
+                if game.check_other_passes():
                     self._new_round()
-                self.game.play_turn()
+                game.play_turn()
                 # Increments turn count
-                self.game.turns += 1
+                game.turns += 1
                 # Set new current player
                 i += 1
 
-            if not self.game.is_game_over():
+            if game.winner is None:
                 # Set new current player
-                self.game.next_player()
+                game.next_player()
 
                 # Check for round end
-                if self.game.check_other_passes():
+                if game.check_other_passes():
                     self._new_round()
                     reward += 20
 
+        self._find_legal_plays()
         return (
             self._get_obs(),
             reward,
-            self.game.is_game_over(),
+            game.winner is not None,
             False,
             self._get_info(),
         )
+
+
+class BigTwoVectorEnv(VectorEnv):
+    """
+    BigTwoEnv over num_envs independent games at once.
+
+    The RLAgent is seat 0 of every game and the opponents are heuristic
+    players simulated in lockstep by a BatchedBigTwoSimulator. Games that
+    end are reset on the next step (next step autoreset). Observations
+    are a (num_envs,) array of discrete last plays and a (num_envs, 52)
+    array of hands, and info["action_mask"] holds the legal actions.
+    """
+
+    metadata = {"autoreset_mode": AutoresetMode.NEXT_STEP}
+
+    def __init__(
+        self,
+        num_envs: int,
+        opponent_types: list[PlayerType] = [PlayerType.Random] * 3,
+    ):
+        assert all(
+            t in POLICIES for t in opponent_types
+        ), "Only heuristic opponents can be simulated"
+        self.num_envs = num_envs
+        self.simulator = BatchedBigTwoSimulator(
+            [PlayerType.RLAgent] + opponent_types, num_envs
+        )
+        self.single_action_space = spaces.Discrete((num_cards * 6) + 1)
+        self.single_observation_space = spaces.Tuple(
+            (
+                spaces.Discrete((num_cards * 6) + 1 + 1),  # + any
+                spaces.Box(low=0, high=1, shape=(num_cards,), dtype=np.int8),
+            )
+        )
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.observation_space = batch_space(
+            self.single_observation_space, num_envs
+        )
+        self._autoreset = np.zeros(num_envs, dtype=bool)
+
+    def _get_obs(self):
+        last_play = np.where(
+            self.simulator.last_play == ANY_ID,
+            52 * 6 + 1,
+            get_catalogue().discrete_ids[
+                np.minimum(self.simulator.last_play, NUM_PLAYS - 1)
+            ],
+        )
+        return last_play, self.simulator.hands[:, 0].astype(np.int8)
+
+    def _get_info(self):
+        """Return the legal discrete actions of every game."""
+        games = np.arange(self.num_envs)
+        plays, legal = self.simulator.legal_plays(games)
+        action_mask = np.zeros((self.num_envs, 52 * 6 + 1), dtype=bool)
+        rows, cols = np.nonzero(legal)
+        action_mask[rows, get_catalogue().discrete_ids[plays[rows, cols]]] = 1
+        # Passing is always allowed
+        action_mask[:, 52 * 6] = True
+        return {"action_mask": action_mask}
+
+    def _play_opponents(self, games) -> np.ndarray:
+        """
+        Play the opponents of games until it is the RLAgent's turn or the
+        game is over. Return which games start a new round for the
+        RLAgent.
+        """
+        simulator = self.simulator
+        while True:
+            waiting = games[
+                (simulator.winner[games] < 0)
+                & (simulator.current_player[games] != 0)
+            ]
+            if not len(waiting):
+                break
+            simulator.step(waiting)
+        playing = simulator.winner[games] < 0
+        new_round = np.zeros(len(games), dtype=bool)
+        new_round[playing] = simulator.start_rounds(games[playing])
+        return new_round
+
+    def reset(
+        self,
+        *,
+        seed: int | list[int] | None = None,
+        options: Optional[dict] = None,
+    ):
+        """
+        Deal every game new hands and play until it is the RLAgent's turn.
+
+        Game i is seeded with seed + i, or seed[i] for a list of seeds.
+        """
+        # VectorEnv.reset only takes a single int seed
+        super().reset(seed=seed if isinstance(seed, int) else None)
+        if isinstance(seed, list):
+            for i, s in enumerate(seed):
+                self.simulator.seed(s, [i])
+        elif seed is not None:
+            self.simulator.seed(seed)
+        games = np.arange(self.num_envs)
+        self.simulator.setup(games)
+        self._play_opponents(games)
+        self._autoreset[:] = False
+        return self._get_obs(), self._get_info()
+
+    def step(self, actions):
+        """
+        Play the RLAgent's action in every game, then its opponents.
+
+        An action is played as the first legal play, in find_plays order,
+        with that discrete id. Games that ended on the last step are reset
+        instead and ignore their action.
+        """
+        catalogue = get_catalogue()
+        simulator = self.simulator
+        actions = np.asarray(actions)
+        assert self.action_space.contains(actions)
+        rewards = np.zeros(self.num_envs)
+
+        resetting = np.flatnonzero(self._autoreset)
+        if len(resetting):
+            simulator.setup(resetting)
+            self._play_opponents(resetting)
+
+        games = np.flatnonzero(~self._autoreset)
+        plays, legal = simulator.legal_plays(games)
+        matches = legal & (
+            catalogue.discrete_ids[plays] == actions[games, None]
+        )
+        passing = actions[games] == 52 * 6
+        assert (passing | matches.any(axis=1)).all(), "Illegal action"
+        chosen = np.where(
+            passing,
+            PASS_ID,
+            plays[np.arange(len(games)), matches.argmax(axis=1)],
+        )
+        # Reward the RLAgent for playing more cards
+        rewards[games] = np.where(
+            passing, 0, catalogue.rank_counts[chosen % PASS_ID].sum(axis=1)
+        )
+        won = simulator.play(games, chosen)
+        rewards[games[won]] += 100
+        rewards[games] += 20 * self._play_opponents(games)
+
+        terminated = np.zeros(self.num_envs, dtype=bool)
+        terminated[games] = simulator.winner[games] >= 0
+        self._autoreset = terminated
+        return (
+            self._get_obs(),
+            rewards,
+            terminated,
+            np.zeros(self.num_envs, dtype=bool),
+            self._get_info(),
+        )
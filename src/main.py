@@ -1,5 +1,10 @@
 from sys import argv
+from typing import Callable, NamedTuple
 import logging
+import math
+import multiprocessing
+import random
+import numpy as np
 import gymnasium as gym
 from gymnasium.envs.registration import register
 from dataclasses import dataclass
@@ -10,8 +15,24 @@ from player import (
     Player,
     RLAgent,
     PlayerType,
+    TurnContext,
 )
-from card import Card, CardCombination, Deck, Play, play2discrete
+from card import (
+    Card,
+    CardCombination,
+    Deck,
+    Play,
+    cards2mask,
+    mask2cards,
+    play2discrete,
+)
+from catalogue import ANY_ID, get_catalogue
+from encoders import ObservationEncoder
+from mcts import MCTSPlayer
+from pools import pool_size
+from qtable import FrozenQTable
+from simulator import BatchedBigTwoSimulator
+from state import GameState
 
 LOGGER = logging.getLogger(__name__)
 
@@ -21,8 +42,7 @@ class AgentStats:
     """Stores how many states agent has visited and
     how many unique actions taken across those states.
 
-    Keeps list of evaluations in the form (wins, opponents)
-    where wins is a count over 100 games
+    Keeps list of Evaluations in the form (wins, opponents, trials)
     """
 
     def __init__(self, states, actions):
@@ -35,8 +55,12 @@ class BigTwoGame:
     def __init__(self, players: list[Player], seed: int | None = None):
         self.players = players
         self.seed = seed
+        # Counts the games dealt, part of the key of a turn
+        self.epoch: int = 0
         for i, p in enumerate(players):
             p.set_id(i)
+            if isinstance(p, MCTSPlayer):
+                p.game = self
         self.setup()
 
     def setup(self):
@@ -66,7 +90,74 @@ class BigTwoGame:
         self.last_play: Play = Play()
         self.last_player: int = 0
         self.turns: int = 0
+        # Kept up to date by remove_cards, so the game never scans hands
+        self.cards_left: list[int] = [len(p.hand) for p in self.players]
+        # Bitmask of the cards played this game
+        self.played: int = 0
         self.winner: Player | None = None
+        self.epoch += 1
+        # (turn key, the current player's plays) of the last turn
+        self._turn: tuple[tuple, TurnContext] | None = None
+
+    def turn_context(self) -> TurnContext:
+        """
+        Return the current player's plays, found once per turn.
+
+        A turn is keyed by the epoch, turns, current player and last play,
+        so the context is dropped once a play is made, a new round starts,
+        the turn moves to another seat or a new game is dealt.
+        """
+        last_play = self.last_play
+        key = (
+            self.epoch,
+            self.turns,
+            self.current_player_index,
+            last_play.combination,
+            last_play.mask,
+        )
+        if self._turn is None or self._turn[0] != key:
+            player = self.players[self.current_player_index]
+            ctx = player.find_plays(self.last_play, self.turns == 0)
+            self._turn = (key, ctx)
+        return self._turn[1]
+
+    def snapshot(self) -> GameState:
+        """Return the game as an immutable GameState."""
+        catalogue = get_catalogue()
+        state = GameState(
+            tuple(cards2mask(p.hand) for p in self.players),
+            catalogue.id_of(self.last_play),
+            sum(1 << i for i, passed in enumerate(self.passes) if passed),
+            self.current_player_index,
+            self.last_player,
+            self.turns,
+            -1 if self.winner is None else self.players.index(self.winner),
+            self.played,
+        )
+        if state.winner < 0 and self.check_other_passes():
+            # The round is over, but no one started a new one yet
+            state = state._replace(last_play=ANY_ID, passes=0)
+        return state
+
+    def restore(self, state: GameState):
+        """Set the game to a GameState, like one from snapshot()."""
+        catalogue = get_catalogue()
+        assert len(state.hands) == len(self.players)
+        for i, p in enumerate(self.players):
+            # Players reindex their moves from hand on their next turn
+            p.hand = mask2cards(state.hands[i])
+        self.cards_left = [len(p.hand) for p in self.players]
+        self.last_play = catalogue.play(state.last_play)
+        self.passes = [
+            bool(state.passes >> i & 1) for i in range(len(self.players))
+        ]
+        self.current_player_index = state.current_player
+        self.last_player = state.last_player
+        self.turns = state.turns
+        self.played = state.played
+        self.winner = None if state.winner < 0 else self.players[state.winner]
+        # A restored turn may have the same key as a cached one
+        self.epoch += 1
 
     def next_player(self):
         self.current_player_index = (self.current_player_index + 1) % len(
@@ -79,24 +170,36 @@ class BigTwoGame:
         Does not advance turn or current player.
         """
         player = self.players[self.current_player_index]
-        LOGGER.info("%s's turn", player.name)
-        ctx = player.find_plays(self.last_play, self.turns == 0)
-        if not isinstance(player, HumanPlayer):
+        verbose = LOGGER.isEnabledFor(logging.INFO)
+        if verbose:
+            LOGGER.info("%s's turn", player.name)
+        ctx = player.find_plays(self.last_play, self.turns == 0, lazy=True)
+        if verbose and not isinstance(player, HumanPlayer):
             LOGGER.info("%s hand: %s", player.name, player.hand)
             LOGGER.info("%s options: %s", player.name, ctx.available_plays)
 
         chosen_play = player.make_play(ctx)
         if not chosen_play.combination == CardCombination.PASS:
-            LOGGER.info("%s plays %s", player.name, chosen_play)
+            if verbose:
+                LOGGER.info("%s plays %s", player.name, chosen_play)
             self.last_play = chosen_play
             self.last_player = self.current_player_index
-            for c in chosen_play.cards:
-                player.hand.remove(c)
+            self.remove_cards(self.current_player_index, chosen_play)
             self.passes[self.current_player_index] = False
         else:
-            LOGGER.info("%s passes", player.name)
+            if verbose:
+                LOGGER.info("%s passes", player.name)
             self.passes[self.current_player_index] = True
 
+    def remove_cards(self, player_index: int, play: Play):
+        """Remove the cards of play from a player's hand."""
+        player = self.players[player_index]
+        player.remove_cards(play.mask)
+        self.played |= play.mask
+        self.cards_left[player_index] = len(player.hand)
+        if not player.hand:
+            self.winner = player
+
     def play_round(self):
         LOGGER.info("New round")
         # Check if all other players have passed their turn
@@ -117,16 +220,8 @@ class BigTwoGame:
                 return False
         return True
 
-    def is_game_over(self):
-        game_over: bool = any(
-            not player.has_cards() for player in self.players
-        )
-        if game_over:
-            for p in self.players:
-                if not p.has_cards():
-                    self.winner = p
-                    break
-        return game_over
+    def is_game_over(self) -> bool:
+        return self.winner is not None
 
     def start(self):
         LOGGER.info("Starting Big Two Game!")
@@ -134,64 +229,34 @@ class BigTwoGame:
         while not self.is_game_over():
             self.play_round()
 
+        winner = self.winner
+        assert winner is not None
         LOGGER.info("Game Over!")
-        for player in self.players:
-            if not player.has_cards():
-                LOGGER.info("%s has won the game!", player.name)
-                return player
-        assert False, "No winner after game ended"
-
-
-def get_greedy_statistics():
-    games: int = 1000
-    random_won: int = 0
-    aggro_won: int = 0
-    safe_won: int = 0
-    safe_won_1v1: int = 0
-
-    for i in range(games):
-        game = BigTwoGame(
-            [
-                AggressivePlayer(name="Aggressive0"),
-                Player(name="Random1"),
-                Player(name="Random2"),
-                Player(name="Random3"),
-            ]
-        )
-        winner: str = game.start().name
-        if winner == "Aggressive0":
-            aggro_won += 1
+        LOGGER.info("%s has won the game!", winner.name)
+        return winner
 
-        game = game = BigTwoGame(
-            [
-                PlayItSafePlayer(name="PlayItSafe0"),
-                Player(name="Random1"),
-                Player(name="Random2"),
-                Player(name="Random3"),
-            ]
-        )
-        winner: str = game.start().name
-        if winner == "PlayItSafe0":
-            safe_won += 1
 
-        game = BigTwoGame(
-            [
-                Player(name="Random0"),
-                Player(name="Random1"),
-                Player(name="Random2"),
-                Player(name="Random3"),
-            ]
+def register_env():
+    """Register the BigTwoRL environments with gymnasium once."""
+    if "BigTwoRL" not in gym.registry:
+        register(
+            id="BigTwoRL",
+            entry_point="env:BigTwoEnv",
+            vector_entry_point="env:BigTwoVectorEnv",
         )
-        winner: str = game.start().name
-        if winner == "Random0":
-            random_won += 1
 
-        game = BigTwoGame(
-            [PlayItSafePlayer(name="PlayItSafe0"), Player(name="Random1")]
-        )
-        winner: str = game.start().name
-        if winner == "PlayItSafe0":
-            safe_won_1v1 += 1
+
+def get_greedy_statistics(games: int = 1000, seed: int | None = None):
+    def wins(player_types: list[PlayerType]) -> int:
+        """Count the games seat 0 wins."""
+        simulator = BatchedBigTwoSimulator(player_types, games, seed)
+        simulator.run()
+        return int(simulator.win_counts()[0])
+
+    random_won = wins([PlayerType.Random] * 4)
+    aggro_won = wins([PlayerType.Aggressive] + [PlayerType.Random] * 3)
+    safe_won = wins([PlayerType.PlayItSafe] + [PlayerType.Random] * 3)
+    safe_won_1v1 = wins([PlayerType.PlayItSafe, PlayerType.Random])
 
     print(f"Random won {random_won}/{games} games against 3 random agents")
     print(f"Aggressive won {aggro_won}/{games} games against 3 random agents")
@@ -209,6 +274,8 @@ def types_to_agents(types: list[PlayerType]) -> list[Player]:
                 opponents.append(AggressivePlayer(name=f"Aggressive{i}"))
             case PlayerType.PlayItSafe:
                 opponents.append(PlayItSafePlayer(name=f"PlayItSafe{i}"))
+            case PlayerType.MCTS:
+                opponents.append(MCTSPlayer(name=f"MCTS{i}"))
             case _:
                 assert False, "Agent should not play against itself"
     return opponents
@@ -216,53 +283,190 @@ def types_to_agents(types: list[PlayerType]) -> list[Player]:
 
 def get_agent_stats(rlagent: RLAgent) -> AgentStats:
     # Evaluate the agent
-    actions = 0
-    for _, a in rlagent.q_values.items():
-        actions += len(a.keys())
-    return AgentStats(len(rlagent.q_values), actions)
+    return AgentStats(len(rlagent.q_values), rlagent.q_values.num_actions())
+
+
+def load_agent(
+    path: str,
+    name: str = "RLAgent",
+    epsilon: float = 0.1,
+    encoder: ObservationEncoder | None = None,
+) -> RLAgent:
+    """
+    Return an RLAgent that plays with the Q table saved at path.
+
+    The table is memory mapped read-only, so the agent can be evaluated
+    but not trained further. It explores with probability epsilon and
+    must use the encoder the table was trained with.
+    """
+    rl_agent = RLAgent(
+        name=name,
+        hand=[],
+        id=-1,
+        initial_epsilon=epsilon,
+        encoder=encoder,
+    )
+    rl_agent.q_values = FrozenQTable(path)
+    return rl_agent
+
+
+class Evaluation(NamedTuple):
+    """Games an agent won out of trials against opponent_types."""
+
+    wins: int
+    opponent_types: list[PlayerType]
+    trials: int = 100
+
+    def win_rate(self) -> float:
+        return self.wins / self.trials
+
+    def confidence_interval(self, z: float = 1.96) -> tuple[float, float]:
+        """Return the Wilson score interval of the win rate, 95% by default."""
+        p, n = self.win_rate(), self.trials
+        center = p + z * z / (2 * n)
+        spread = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+        return (
+            (center - spread) / (1 + z * z / n),
+            (center + spread) / (1 + z * z / n),
+        )
+
+
+# The agent being evaluated. Forked evaluation workers inherit it, so its
+# Q table is shared copy-on-write instead of being pickled to them.
+_evaluated_agent: RLAgent | None = None
+
+
+def _evaluate_trials(
+    opponent_types: list[PlayerType],
+    seed: int | None,
+    trial_seed: int,
+    trials: range,
+) -> int:
+    """Play trials with _evaluated_agent and return how many it won."""
+    from env import BigTwoEnv
+
+    assert _evaluated_agent is not None
+    players = [_evaluated_agent, *types_to_agents(opponent_types)]
+    game: BigTwoGame = BigTwoGame(players, seed=seed)
+    env = BigTwoEnv(game)
+    wins = 0
+    # Players draw from the global random streams, which are reseeded for
+    # every trial. Leave the caller's streams as they were.
+    states = random.getstate(), np.random.get_state()
+    try:
+        for trial in trials:
+            # Every trial plays the same whichever worker runs it
+            random.seed(trial_seed + trial)
+            np.random.seed(trial_seed + trial)
+            if seed is None:
+                game.seed = trial_seed + trial
+            obs, info = env.reset()
+            agents = game.players
+            done = False
+
+            while not done:
+                agent = agents[game.current_player_index]
+                turn_context = env.turn_context
+                assert turn_context is not None
+                if isinstance(agent, RLAgent):
+                    play = agent.make_play(turn_context, obs)
+                else:
+                    play = agent.make_play(turn_context)
+                action = play2discrete(play)
+                next_obs, reward, done, _, info = env.step(action)
+
+                obs = next_obs
+
+            LOGGER.info(
+                "%s has won the game!", agents[game.current_player_index].name
+            )
+            if game.current_player_index == env.rl_agentid:
+                wins += 1
+    finally:
+        random.setstate(states[0])
+        np.random.set_state(states[1])
+    return wins
 
 
 def evaluate_agent(
     rlagent: RLAgent,
     opponent_types: list[PlayerType] = [PlayerType.Random] * 3,
     seed: int | None = None,
-) -> tuple[int, list[PlayerType]]:
-    assert len(opponent_types) == 3
-    from env import BigTwoEnv
+    trials: int = 100,
+    trial_seed: int = 0,
+    workers: int | None = None,
+) -> Evaluation:
+    """
+    Play trials games against opponent_types and count the agent's wins.
 
-    num_trials = 100
-    wins = 0
-    opponents: list[Player] = types_to_agents(opponent_types)
+    A seed fixes the deal of every game, otherwise trial i is dealt with
+    seed trial_seed + i. Trial i also seeds the players' random streams
+    with trial_seed + i, so results do not depend on workers. The trials
+    are split over a pool of at most workers forked processes.
+    """
+    global _evaluated_agent
+    assert len(opponent_types) == 3
+    workers = pool_size(workers, trials)
+    _evaluated_agent = rlagent
+    try:
+        if workers == 1:
+            wins = _evaluate_trials(
+                opponent_types, seed, trial_seed, range(trials)
+            )
+        else:
+            bounds = np.linspace(0, trials, 4 * workers + 1).astype(int)
+            jobs = [
+                (opponent_types, seed, trial_seed, range(a, b))
+                for a, b in zip(bounds[:-1], bounds[1:])
+            ]
+            with multiprocessing.get_context("fork").Pool(workers) as pool:
+                wins = sum(pool.starmap(_evaluate_trials, jobs))
+    finally:
+        _evaluated_agent = None
+    return Evaluation(wins, opponent_types, trials)
+
+
+def run_training_episodes(
+    rl_agent: RLAgent,
+    env: gym.Env,
+    episodes: int,
+    visits: dict | None = None,
+):
+    """
+    Train rl_agent on episodes games of env.
 
-    game: BigTwoGame = BigTwoGame([rlagent] + opponents, seed=seed)
-    env = gym.make("BigTwoRL", game=game)
-    assert isinstance(env.unwrapped, BigTwoEnv)
+    If visits is given, count the updates of each state and action in it.
+    """
+    from env import BigTwoEnv
 
-    for _ in range(num_trials):
-        obs, info = env.reset()
+    bigtwo = env.unwrapped
+    assert isinstance(bigtwo, BigTwoEnv)
+    game: BigTwoGame = bigtwo.game
+    for episode in range(episodes):
+        obs, _ = env.reset()
         agents = game.players
         done = False
 
+        # Each iteration should start when it's our agent's turn
         while not done:
             agent = agents[game.current_player_index]
-            turn_context = agent.find_plays(game.last_play, game.turns == 0)
-            if isinstance(agent, RLAgent):
-                play = agent.make_play(turn_context, obs)
-            else:
-                play = agent.make_play(turn_context)
+            assert isinstance(agent, RLAgent)
+            turn_context = bigtwo.turn_context
+            assert turn_context is not None
+            play = agent.make_play(turn_context, obs)
             action = play2discrete(play)
             next_obs, reward, done, _, info = env.step(action)
 
+            agent.update(obs, action, reward, done, next_obs, info, play)
+            if visits is not None:
+                state = agent.make_obs_hashable(obs)
+                visits[state][agent.encode_action(obs, action, play)] += 1
+
             obs = next_obs
 
-        LOGGER.info(
-            "%s has won the game!", agents[game.current_player_index].name
-        )
-        if game.current_player_index == env.unwrapped.rl_agentid:
-            wins += 1
+        rl_agent.decay_epsilon()
 
         game.setup()
-    return wins, opponent_types
 
 
 def train_agent(
@@ -271,12 +475,33 @@ def train_agent(
     opponent_types: list[PlayerType] = [PlayerType.Random] * 3,
     alpha: float = 0.1,
     seed: int | None = None,
+    checkpoint: Callable[[RLAgent, int], None] | None = None,
+    checkpoint_every: int = 1000,
+    replay_capacity: int = 0,
+    n_step: int = 1,
+    encoder: ObservationEncoder | None = None,
 ):
+    """
+    Train an RLAgent against opponent_types.
+
+    checkpoint(agent, episodes_done) is called every checkpoint_every
+    episodes, e.g. to record a learning curve. With replay_capacity > 0
+    the agent learns from n_step transitions replayed from a buffer.
+    encoder keys the agent's Q table, see encoders.py.
+    """
     from env import BigTwoEnv
 
     print(f"Training agent {name}...")
 
-    rl_agent = RLAgent(name=name, hand=[], id=-1, alpha=alpha)
+    rl_agent = RLAgent(
+        name=name,
+        hand=[],
+        id=-1,
+        alpha=alpha,
+        replay_capacity=replay_capacity,
+        n_step=n_step,
+        encoder=encoder,
+    )
     opponents = types_to_agents(opponent_types)
 
     game: BigTwoGame = BigTwoGame([rl_agent] + opponents, seed=seed)
@@ -284,94 +509,211 @@ def train_agent(
     env = gym.make("BigTwoRL", game=game)
     assert isinstance(env.unwrapped, BigTwoEnv)
 
-    for episode in range(episodes):
-        obs, _ = env.reset()
-        agents = game.players
-        done = False
+    if checkpoint is None:
+        run_training_episodes(rl_agent, env, episodes)
+    else:
+        for done in range(0, episodes, checkpoint_every):
+            n = min(checkpoint_every, episodes - done)
+            run_training_episodes(rl_agent, env, n)
+            checkpoint(rl_agent, done + n)
+    print(f"Finished training {name}")
+    return rl_agent
 
-        # Each iteration should start when it's our agent's turn
-        while not done:
-            agent = agents[game.current_player_index]
-            assert isinstance(agent, RLAgent)
-            turn_context = agent.find_plays(game.last_play, game.turns == 0)
-            play = agent.make_play(turn_context, obs)
-            action = play2discrete(play)
-            next_obs, reward, done, _, _ = env.step(action)
-
-            agent.update(
-                obs,
-                action,
-                reward,
-                done,
-                next_obs,
-                env.unwrapped._get_info(),
-            )
 
-            obs = next_obs
+def train_agent_vectorized(
+    name="RLAgent",
+    episodes: int = 100000,
+    opponent_types: list[PlayerType] = [PlayerType.Random] * 3,
+    alpha: float = 0.1,
+    num_envs: int = 64,
+    seed: int | None = None,
+):
+    """Train an RLAgent on num_envs games at once."""
+    from env import BigTwoVectorEnv
 
-        rl_agent.decay_epsilon()
+    print(f"Training agent {name}...")
 
-        game.setup()
+    rl_agent = RLAgent(name=name, hand=[], id=-1, alpha=alpha)
+    envs = BigTwoVectorEnv(num_envs, opponent_types)
+    obs, info = envs.reset(seed=seed)
+    # Games reset on the step after they end, skip those transitions
+    resetting = np.zeros(num_envs, dtype=bool)
+    finished = 0
+    while finished < episodes:
+        actions = np.array(
+            [
+                rl_agent.act((obs[0][i], obs[1][i]), info["action_mask"][i])
+                for i in range(num_envs)
+            ]
+        )
+        next_obs, rewards, terminated, _, info = envs.step(actions)
+        for i in np.flatnonzero(~resetting):
+            rl_agent.update(
+                (obs[0][i], obs[1][i]),
+                actions[i],
+                rewards[i],
+                terminated[i],
+                (next_obs[0][i], next_obs[1][i]),
+                info,
+            )
+        for _ in range(terminated.sum()):
+            rl_agent.decay_epsilon()
+        finished += terminated.sum()
+        obs = next_obs
+        resetting = terminated
     print(f"Finished training {name}")
     return rl_agent
 
 
-def evaluate_against_all(rlagent: RLAgent, seed: int | None = None):
+# Every agent is evaluated against three of each of these
+EVALUATION_OPPONENTS: tuple[PlayerType, ...] = (
+    PlayerType.Random,
+    PlayerType.Aggressive,
+    PlayerType.PlayItSafe,
+)
+
+
+def evaluate_against_all(
+    rlagent: RLAgent,
+    seed: int | None = None,
+    trials: int = 100,
+    workers: int | None = None,
+) -> list[Evaluation]:
     print(f"Evaluating {rlagent.name}...")
     stats = []
-    stats.append(evaluate_agent(rlagent, seed=seed))
-    stats.append(
-        evaluate_agent(rlagent, [PlayerType.Aggressive] * 3, seed=seed)
-    )
-    stats.append(
-        evaluate_agent(rlagent, [PlayerType.PlayItSafe] * 3, seed=seed)
-    )
+    for opponent_type in EVALUATION_OPPONENTS:
+        stats.append(
+            evaluate_agent(
+                rlagent,
+                [opponent_type] * 3,
+                seed=seed,
+                trials=trials,
+                workers=workers,
+            )
+        )
     print(f"Finished evaluating {rlagent.name}")
     return stats
 
 
-if __name__ == "__main__":
-    if len(argv) > 1 and argv[1].lower() == "info":
-        logging.basicConfig(level=logging.INFO)
-
-    register(
-        id="BigTwoRL",
-        entry_point="env:BigTwoEnv",
+@dataclass
+class Experiment:
+    """An RLAgent to train against opponent_types and then evaluate."""
+
+    name: str
+    episodes: int
+    opponent_types: list[PlayerType]
+    # Fixes the deal of every training and evaluation game
+    seed: int | None = None
+    # Where to save the trained Q table, if anywhere
+    qtable_path: str | None = None
+
+
+# The base agent and the fixed deck agents D0-D4
+EXPERIMENTS: list[Experiment] = [
+    Experiment(
+        "P3E50000",
+        50000,
+        [PlayerType.PlayItSafe] * 3,
+        qtable_path="P3E50000.qtable",
+    )
+] + [
+    Experiment(
+        f"P3E50000D{i}",
+        50000,
+        [PlayerType.PlayItSafe] * 3,
+        seed=i,
+        qtable_path=f"P3E50000D{i}.qtable",
     )
-    agents: list[RLAgent] = []
-    agent_stats: list[list[tuple[int, list[PlayerType]]]] = []
-    base_e = 50000
-    base_opps = PlayerType.PlayItSafe
+    for i in range(5)
+]
+
+
+def train_experiment(experiment: Experiment) -> RLAgent:
+    """Train the agent of an experiment and save its Q table."""
+    register_env()
     rl_agent = train_agent(
-        name=f"{base_opps.name[0]}3E{base_e}",
-        episodes=base_e,
-        opponent_types=[base_opps] * 3,
+        name=experiment.name,
+        episodes=experiment.episodes,
+        opponent_types=experiment.opponent_types,
+        seed=experiment.seed,
     )
-    agents.append(rl_agent)
-    agent_stats.append(evaluate_against_all(rl_agent))
-
-    fixed_e = 50000
-    fixed_opps = PlayerType.PlayItSafe
-    for i in range(0, 5):
-        f = train_agent(
-            name=f"{fixed_opps.name[0]}3E{fixed_e}D{i}",
-            episodes=fixed_e,
-            seed=i,
-            opponent_types=[fixed_opps] * 3,
+    if experiment.qtable_path is not None:
+        rl_agent.trainable_q_values().save(experiment.qtable_path)
+    return rl_agent
+
+
+def _train_experiment(job: tuple[int, Experiment]) -> tuple[int, RLAgent]:
+    i, experiment = job
+    return i, train_experiment(experiment)
+
+
+def run_experiment(experiment: Experiment) -> tuple[str, AgentStats]:
+    """Train and evaluate the agent of an experiment."""
+    rl_agent = train_experiment(experiment)
+    stats = get_agent_stats(rl_agent)
+    stats.evals = evaluate_against_all(rl_agent, seed=experiment.seed)
+    return rl_agent.name, stats
+
+
+def run_experiments(
+    experiments: list[Experiment], workers: int | None = None
+) -> list[tuple[str, AgentStats]]:
+    """
+    Run experiments as jobs on a pool of at most workers processes.
+
+    Every training is a job, and so is every evaluation of a trained
+    agent against one opponent type, so evaluations run alongside the
+    trainings left. Results come back in the order of experiments.
+    """
+    if workers == 1:
+        return [run_experiment(e) for e in experiments]
+    names: dict[int, str] = {}
+    stats: dict[int, AgentStats] = {}
+    evaluations: dict[int, list] = {}
+    # A fresh process per job frees each agent's Q table once it is done
+    with multiprocessing.Pool(workers, maxtasksperchild=1) as pool:
+        trained = pool.imap_unordered(
+            _train_experiment, enumerate(experiments)
         )
-        agents.append(f)
-        agent_stats.append(evaluate_against_all(f, seed=i))
+        for i, rl_agent in trained:
+            names[i] = rl_agent.name
+            stats[i] = get_agent_stats(rl_agent)
+            # Trained agents pickle, so each evaluation is a job of its own
+            evaluations[i] = [
+                pool.apply_async(
+                    evaluate_agent,
+                    (rl_agent, [opponent_type] * 3, experiments[i].seed),
+                )
+                for opponent_type in EVALUATION_OPPONENTS
+            ]
+        for i, jobs in evaluations.items():
+            stats[i].evals = [job.get() for job in jobs]
+    return [(names[i], stats[i]) for i in range(len(experiments))]
 
-    with open("results.md", "w", encoding="utf-8") as f:
-        for i, a in enumerate(agents):
-            stats = get_agent_stats(a)
-            f.write(f"# {a.name}\n")
+
+def write_results(
+    results: list[tuple[str, AgentStats]], path: str = "results.md"
+):
+    with open(path, "w", encoding="utf-8") as f:
+        for name, stats in results:
+            f.write(f"# {name}\n")
             f.write(f"- Visited {stats.num_states} states\n")
             f.write(
                 f"- Took {stats.num_actions} Play-likes across these states\n"
             )
             f.write("## Evaluations\n")
-            for s in agent_stats[i]:
+            for s in stats.evals:
                 f.write(
-                    f"- {s[0]}/100 games against `{[o.name for o in s[1]]}`\n"
+                    f"- {s.wins}/{s.trials} games against "
+                    f"`{[o.name for o in s.opponent_types]}`\n"
                 )
+
+
+if __name__ == "__main__":
+    if len(argv) > 1 and argv[1].lower() == "info":
+        logging.basicConfig(level=logging.INFO)
+    # Run at most this many jobs at once, all cores by default
+    workers = next((int(a) for a in argv[1:] if a.isdigit()), None)
+
+    register_env()
+    write_results(run_experiments(EXPERIMENTS, workers))
@@ -0,0 +1,255 @@
+"""
+Information set Monte Carlo tree search player.
+
+MCTSPlayer searches from GameState snapshots of its game. Every iteration
+deals the cards it cannot see to the opponents at random, a
+determinisation, and descends one shared tree of moves (single observer
+ISMCTS): children are only chosen among the moves legal in that deal and
+are scored by how often they were available. New leaves are played out
+with one of the simulator's heuristic policies.
+
+The search stops after a number of iterations or seconds, whichever comes
+first. With workers > 1, independent trees are searched in forked
+processes and their root visit counts are summed (root parallelisation).
+The processes are started on the first such move and kept until close().
+"""
+
+import math
+import multiprocessing
+import random
+import time
+from typing import TYPE_CHECKING
+import numpy as np
+from bitmask import FULL_DECK, iter_indices
+from card import CardCombination, Play
+from catalogue import ANY_ID, PASS_ID, get_catalogue
+from player import Player, PlayerType, TurnContext
+from pools import pool_size
+from simulator import POLICIES
+from state import GameState
+
+if TYPE_CHECKING:
+    from main import BigTwoGame
+
+
+class Node:
+    """Statistics of a move in the search tree."""
+
+    __slots__ = ("children", "visits", "wins", "available")
+
+    def __init__(self):
+        self.children: dict[int, Node] = {}
+        self.visits: int = 0
+        # Wins of the player who made the move
+        self.wins: float = 0.0
+        # Iterations where the move was legal
+        self.available: int = 0
+
+    def ucb(self, exploration: float) -> float:
+        return self.wins / self.visits + exploration * math.sqrt(
+            math.log(self.available) / self.visits
+        )
+
+
+def determinise(state: GameState, observer: int, rng: random.Random):
+    """
+    Deal the cards the observer cannot see to the other seats at random,
+    keeping how many cards each holds.
+
+    The observer cannot see the cards that are neither in its hand nor
+    played. With 2 players some of them were never dealt, so the other
+    seats' hands are not known even together.
+    """
+    unseen = list(
+        iter_indices(FULL_DECK & ~state.hands[observer] & ~state.played)
+    )
+    rng.shuffle(unseen)
+    hands = list(state.hands)
+    for seat, hand in enumerate(state.hands):
+        if seat == observer:
+            continue
+        count = hand.bit_count()
+        hands[seat] = sum(1 << i for i in unseen[:count])
+        unseen = unseen[count:]
+    return state._replace(hands=tuple(hands))
+
+
+def rollout(state: GameState, policy, rng: random.Random) -> int:
+    """Play state to the end with a simulator policy, return the winner."""
+    catalogue = get_catalogue()
+    # The plays in each hand, dropped once their cards are played
+    plays = [
+        np.flatnonzero(catalogue.legal_mask(hand, ANY_ID))
+        for hand in state.hands
+    ]
+    while state.winner < 0:
+        seat = state.current_player
+        candidates = plays[seat]
+        legal = catalogue.beats(state.last_play)[candidates]
+        if state.turns == 0:
+            legal &= catalogue.game_starts[candidates]
+        if legal.any():
+            action = int(
+                policy(
+                    candidates[None], legal[None], np.array([rng.random()])
+                )[0]
+            )
+            played = catalogue.masks[action]
+            plays[seat] = candidates[
+                (catalogue.masks[candidates] & played) == 0
+            ]
+        else:
+            # Heuristic players only pass when they cannot play
+            action = PASS_ID
+        state = state.apply(action)
+    return state.winner
+
+
+def search(
+    state: GameState,
+    iterations: int | None = 1000,
+    time_limit: float | None = None,
+    rollout_policy: PlayerType = PlayerType.PlayItSafe,
+    exploration: float = 0.7,
+    seed: int | None = None,
+) -> dict[int, int]:
+    """
+    Search from the current player's view of state and return how often
+    each of its moves was visited.
+    """
+    assert iterations is not None or time_limit is not None, "No budget"
+    rng = random.Random(seed)
+    policy = POLICIES[rollout_policy]
+    observer = state.current_player
+    root = Node()
+    deadline = None if time_limit is None else time.time() + time_limit
+    done = 0
+    while (iterations is None or done < iterations) and (
+        deadline is None or time.time() < deadline
+    ):
+        current = determinise(state, observer, rng)
+        node = root
+        # (node, seat that made its move) of the moves made this iteration
+        path: list[tuple[Node, int]] = []
+        while current.winner < 0:
+            actions = current.legal_actions()
+            for a in actions:
+                child = node.children.get(a)
+                if child is not None:
+                    child.available += 1
+            untried = [a for a in actions if a not in node.children]
+            if untried:
+                action = rng.choice(untried)
+                child = node.children[action] = Node()
+                child.available += 1
+                path.append((child, current.current_player))
+                current = current.apply(action)
+                break
+            action = max(
+                actions, key=lambda a: node.children[a].ucb(exploration)
+            )
+            node = node.children[action]
+            path.append((node, current.current_player))
+            current = current.apply(action)
+        winner = rollout(current, policy, rng)
+        for node, seat in path:
+            node.visits += 1
+            node.wins += winner == seat
+        done += 1
+    return {a: child.visits for a, child in root.children.items()}
+
+
+class MCTSPlayer(Player):
+    def __init__(
+        self,
+        *,
+        name,
+        hand=[],
+        id=0,
+        iterations: int | None = 1000,
+        time_limit: float | None = None,
+        rollout_policy: PlayerType = PlayerType.PlayItSafe,
+        exploration: float = 0.7,
+        workers: int = 1,
+    ):
+        """
+        Every move is searched for iterations iterations or time_limit
+        seconds, whichever ends first, in each of workers trees.
+
+        BigTwoGame sets game, the game whose snapshots are searched.
+        Call close() to stop the worker processes when workers > 1.
+        """
+        super().__init__(name=name, hand=hand, id=id)
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.rollout_policy = rollout_policy
+        self.exploration = exploration
+        self.workers = workers
+        self.game: "BigTwoGame | None" = None
+        self._pool = None
+        self._pool_workers = 0
+
+    def __getstate__(self):
+        # A pool only works in the process that started it
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        state["_pool_workers"] = 0
+        return state
+
+    def _get_pool(self, workers: int):
+        if self._pool is None or self._pool_workers != workers:
+            self.close()
+            self._pool = multiprocessing.get_context("fork").Pool(workers)
+            self._pool_workers = workers
+        return self._pool
+
+    def close(self):
+        """Stop the worker processes, if any."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self._pool_workers = 0
+
+    def make_play(self, ctx: TurnContext) -> Play:
+        """Play the move visited most by the search."""
+        start = time.time()
+        if not ctx.available_plays:
+            return Play([], CardCombination.PASS)
+        assert self.game is not None, "MCTSPlayer is not in a game"
+        state = self.game.snapshot()
+        assert state.current_player == self.id
+        actions = state.legal_actions()
+        if len(actions) == 1:
+            return get_catalogue().play(actions[0])
+
+        workers = pool_size(self.workers)
+        pool = None if workers == 1 else self._get_pool(workers)
+        time_limit = self.time_limit
+        if time_limit is not None:
+            # The move's budget also covers starting the pool
+            time_limit = max(time_limit - (time.time() - start), 0.0)
+        # Drawn from random, so seeding random fixes the search
+        seeds = [random.getrandbits(32) for _ in range(workers)]
+        jobs = [
+            (
+                state,
+                self.iterations,
+                time_limit,
+                self.rollout_policy,
+                self.exploration,
+                seed,
+            )
+            for seed in seeds
+        ]
+        if pool is None:
+            results = [search(*jobs[0])]
+        else:
+            results = pool.starmap(search, jobs)
+        visits = dict.fromkeys(actions, 0)
+        for result in results:
+            for a, n in result.items():
+                visits[a] += n
+        # Ties go to the first move in find_plays order
+        best = max(actions, key=lambda a: visits[a])
+        return get_catalogue().play(best)
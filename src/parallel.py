@@ -0,0 +1,236 @@
+"""
+Parallel RLAgent training over a pool of worker processes.
+
+Every worker trains its own RLAgent, a shard of the master Q table,
+against its own BigTwoEnv. Every sync_every episodes the workers send the
+Q values they updated, with how often they updated them, and the master
+merges them into its table. The merged values are sent back to every
+worker before the next batch of episodes, so all shards start each batch
+equal to the master table.
+"""
+
+import multiprocessing
+import os
+import random
+import time
+from collections import Counter, defaultdict
+from sys import argv
+import numpy as np
+from main import (
+    BigTwoGame,
+    evaluate_agent,
+    register_env,
+    run_training_episodes,
+    train_agent,
+    types_to_agents,
+)
+from player import PlayerType, RLAgent
+from qtable import QTable
+
+# State key -> action -> (Q value, updates)
+Shard = dict[int, dict[int, tuple[float, int]]]
+
+
+def _train_worker(
+    conn,
+    opponent_types: list[PlayerType],
+    alpha: float,
+    seed: int | None,
+):
+    """
+    Train a Q table shard on the batches of episodes sent through conn.
+
+    Each message is (merged values, epsilon, current episode, episodes),
+    None stops the worker.
+    """
+    from env import BigTwoEnv
+
+    # Forked workers would otherwise all share the same random streams
+    random.seed()
+    np.random.seed()
+    rl_agent = RLAgent(name="Shard", hand=[], id=-1, alpha=alpha)
+    game = BigTwoGame([rl_agent] + types_to_agents(opponent_types), seed=seed)
+    env = BigTwoEnv(game)
+    q_values = rl_agent.trainable_q_values()
+    while (message := conn.recv()) is not None:
+        merged, epsilon, current_episode, episodes = message
+        for obs, actions in merged.items():
+            q_values[obs].update(actions)
+        rl_agent.epsilon = epsilon
+        rl_agent.current_episode = current_episode
+
+        visits: dict[int, Counter] = defaultdict(Counter)
+        run_training_episodes(rl_agent, env, episodes, visits)
+        shard: Shard = {
+            obs: {a: (q_values[obs][a], n) for a, n in actions.items()}
+            for obs, actions in visits.items()
+        }
+        conn.send(shard)
+    conn.close()
+
+
+def merge_shards(
+    q_values: QTable, shards: list[Shard], merge: str = "mean"
+) -> dict[int, dict[int, float]]:
+    """
+    Merge worker shards into the master q_values, return the merged values.
+
+    "mean" averages the values of all workers, where workers that did not
+    update a value still hold the master value. "visits" weights the
+    workers that updated a value by how often they did.
+    """
+    assert merge in ("mean", "visits"), f"Unknown merge {merge}"
+    updates: dict[int, dict[int, list[tuple[float, int]]]] = defaultdict(
+        lambda: defaultdict(list)
+    )
+    for shard in shards:
+        for obs, actions in shard.items():
+            for a, entry in actions.items():
+                updates[obs][a].append(entry)
+
+    merged: dict[int, dict[int, float]] = {}
+    for obs, actions in updates.items():
+        merged[obs] = {}
+        for a, entries in actions.items():
+            if merge == "mean":
+                master = q_values[obs][a] if obs in q_values else 0.0
+                untouched = len(shards) - len(entries)
+                value = (
+                    sum(v for v, _ in entries) + untouched * master
+                ) / len(shards)
+            else:
+                value = sum(v * n for v, n in entries) / sum(
+                    n for _, n in entries
+                )
+            q_values[obs][a] = value
+            merged[obs][a] = value
+    return merged
+
+
+def train_agent_parallel(
+    name="RLAgent",
+    episodes: int = 100000,
+    opponent_types: list[PlayerType] = [PlayerType.Random] * 3,
+    alpha: float = 0.1,
+    seed: int | None = None,
+    workers: int | None = None,
+    sync_every: int = 500,
+    merge: str = "mean",
+    checkpoint=None,
+):
+    """
+    Train an RLAgent like train_agent, with episodes split over workers.
+
+    Shards are merged every sync_every episodes of each worker, with
+    merge_shards. checkpoint(agent, episodes_done) is called after every
+    merge.
+    """
+    workers = workers or os.cpu_count() or 1
+    print(f"Training agent {name} on {workers} workers...")
+
+    rl_agent = RLAgent(name=name, hand=[], id=-1, alpha=alpha)
+    conns = []
+    processes = []
+    for _ in range(workers):
+        conn, worker_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=_train_worker,
+            args=(worker_conn, opponent_types, alpha, seed),
+            daemon=True,
+        )
+        process.start()
+        conns.append(conn)
+        processes.append(process)
+
+    merged: dict = {}
+    done = 0
+    while done < episodes:
+        batch = min(sync_every * workers, episodes - done)
+        # Split the batch evenly, the last batch may leave workers idle
+        counts = [
+            batch // workers + (i < batch % workers) for i in range(workers)
+        ]
+        busy = [conn for conn, n in zip(conns, counts) if n > 0]
+        for conn, n in zip(busy, counts):
+            conn.send((merged, rl_agent.epsilon, rl_agent.current_episode, n))
+        shards = [conn.recv() for conn in busy]
+        merged = merge_shards(rl_agent.trainable_q_values(), shards, merge)
+        for _ in range(batch):
+            rl_agent.decay_epsilon()
+        done += batch
+        if checkpoint is not None:
+            checkpoint(rl_agent, done)
+
+    for conn in conns:
+        conn.send(None)
+    for process in processes:
+        process.join()
+    print(f"Finished training {name}")
+    return rl_agent
+
+
+def compare_learning_curves(
+    episodes: int = 20000,
+    checkpoint_every: int = 2000,
+    opponent_types: list[PlayerType] = [PlayerType.PlayItSafe] * 3,
+    workers: int | None = None,
+    merges: tuple[str, ...] = ("mean", "visits"),
+    path: str = "learning_curves.md",
+):
+    """
+    Train agents serially and in parallel, evaluating them along the way.
+
+    Write the wins out of 100 games against opponent_types, the states
+    visited and the wall time at every checkpoint to path.
+    """
+    register_env()
+    workers = workers or os.cpu_count() or 1
+    curves: dict[str, list[tuple[int, int, int, float]]] = {}
+
+    def record(label: str, start: float):
+        def checkpoint(rl_agent: RLAgent, done: int):
+            wins = evaluate_agent(rl_agent, opponent_types).wins
+            curves[label].append(
+                (done, wins, len(rl_agent.q_values), time.time() - start)
+            )
+
+        curves[label] = []
+        return checkpoint
+
+    train_agent(
+        "Serial",
+        episodes,
+        opponent_types,
+        checkpoint=record("Serial", time.time()),
+        checkpoint_every=checkpoint_every,
+    )
+    for merge in merges:
+        label = f"Parallel ({merge})"
+        train_agent_parallel(
+            label,
+            episodes,
+            opponent_types,
+            workers=workers,
+            sync_every=max(1, checkpoint_every // workers),
+            merge=merge,
+            checkpoint=record(label, time.time()),
+        )
+
+    with open(path, "w", encoding="utf-8") as f:
+        opponents = [o.name for o in opponent_types]
+        for label, points in curves.items():
+            f.write(f"# {label}\n")
+            f.write(
+                f"| Episodes | Wins/100 vs `{opponents}` | States | Seconds |\n"
+            )
+            f.write("|---|---|---|---|\n")
+            for done, wins, states, seconds in points:
+                f.write(f"| {done} | {wins} | {states} | {seconds:.1f} |\n")
+
+
+if __name__ == "__main__":
+    episodes = int(argv[1]) if len(argv) > 1 else 20000
+    checkpoint_every = int(argv[2]) if len(argv) > 2 else 2000
+    compare_learning_curves(
+        episodes=episodes, checkpoint_every=checkpoint_every
+    )
@@ -1,22 +1,74 @@
-from bisect import bisect_left, bisect_right
-from collections import deque, defaultdict
-from dataclasses import dataclass, field
-import itertools
+from bisect import bisect_right
 import typing
 import random
 from card import *
-
+from bitmask import (
+    ALL_COMBINATIONS,
+    THREE_OF_DIAMONDS,
+    find_play_masks,
+    highest,
+    mask2play,
+    play_key,
+    remove,
+    same_rank_masks,
+    search_combinations,
+)
+from encoders import ObservationEncoder
+from qtable import QTable, QValues
+from replay import Batch, ReplayBuffer
 
 Cards = typing.List[Card]
 
 
-@dataclass
 class TurnContext:
-    """Contains available plays, the last play, and game start status."""
+    """
+    Contains available plays, the last play, and game start status.
+
+    A lazy context from Player.find_plays(lazy=True) only builds
+    available_plays when it is first read. iter_plays() streams the plays
+    instead, so strategies can stop early.
+    """
+
+    def __init__(
+        self,
+        available_plays: list[Play] | None = None,
+        last_play: Play | None = None,
+        game_start: bool = False,
+        player: "Player | None" = None,
+    ):
+        self._available_plays = available_plays
+        self.last_play: Play = Play() if last_play is None else last_play
+        self.game_start: bool = game_start
+        self._player = player
+        # The play an RLAgent chose in this context
+        self.chosen: Play | None = None
+
+    @property
+    def available_plays(self) -> list[Play]:
+        if self._available_plays is None:
+            self._available_plays = (
+                []
+                if self._player is None
+                else self._player.find_plays(
+                    self.last_play, self.game_start
+                ).available_plays
+            )
+        return self._available_plays
+
+    @available_plays.setter
+    def available_plays(self, plays: list[Play]):
+        self._available_plays = plays
 
-    available_plays: list[Play] = field(default_factory=list)
-    last_play: Play = field(default_factory=Play)
-    game_start: bool = False
+    def iter_plays(self, reverse=False) -> typing.Iterator[Play]:
+        """Yield the available plays by combination, then ascending strength."""
+        if self._available_plays is None and self._player is not None:
+            return self._player.iter_plays(
+                self.last_play, self.game_start, reverse
+            )
+        plays = sorted(
+            self.available_plays, key=lambda p: (p.combination, p.key)
+        )
+        return reversed(plays) if reverse else iter(plays)
 
 
 class Player:
@@ -24,155 +76,111 @@ class Player:
 
     def __init__(self, *, name, hand=[], id=0):
         self.name: str = name
-        self.hand: Cards = sorted(hand)
+        self.set_hand(hand)
         self.id: int = id
 
     def set_hand(self, hand):
-        self.hand = sorted(hand)
+        self.hand: Cards = sorted(hand)
+        self._index_moves()
+
+    def _index_moves(self):
+        """
+        Index every play in hand by combination, in find_plays order.
+
+        Plays are indexed as (mask, key) and only built into Plays when
+        they are first returned.
+        """
+        self._indexed_hand: int = cards2mask(self.hand)
+        self._moves: dict[CardCombination, list[tuple[int, int]]] = {
+            c: [] for c in ALL_COMBINATIONS
+        }
+        for m, c in find_play_masks(self._indexed_hand):
+            self._moves[c].append((m, play_key(m, c)))
+        # The same entries sorted by key, made on demand by iter_plays
+        self._ranked: dict[CardCombination, list[tuple[int, int]]] = {}
+        self._plays: dict[int, Play] = {}
+
+    def _play(self, mask: int, combination: CardCombination, key: int) -> Play:
+        """Return the Play of an indexed mask, building it once."""
+        play = self._plays.get(mask)
+        if play is None:
+            play = self._plays[mask] = mask2play(mask, combination, key)
+        return play
+
+    def _sync_moves(self):
+        """
+        Bring the move index up to date with hand.
+
+        Only the plays that used removed cards are dropped. If cards were
+        added to hand, the index is rebuilt.
+        """
+        hand = cards2mask(self.hand)
+        if hand == self._indexed_hand:
+            return
+        if hand & ~self._indexed_hand:
+            self._index_moves()
+            return
+        removed = self._indexed_hand & ~hand
+        for c, moves in self._moves.items():
+            self._moves[c] = [e for e in moves if not e[0] & removed]
+        self._ranked.clear()
+        self._indexed_hand = hand
 
     def set_id(self, id: int):
         self.id = id
 
     def find_plays(
-        self, last_play: Play = Play(), game_start=False
+        self, last_play: Play = Play(), game_start=False, lazy=False
     ) -> TurnContext:
         """
         Return all valid plays compatible with the current combination.
 
         Filter out all plays worse than last_play.
         If start is True, consider only plays with 3 of Diamonds
+        If lazy is True, no Play is built until the context is read.
         """
         assert last_play.combination != CardCombination.INVALID
         if last_play.combination == CardCombination.ANY:
             assert len(last_play.cards) == 0
-        all_combos: list[CardCombination] = [
-            CardCombination.SINGLE,
-            CardCombination.PAIR,
-            CardCombination.TRIPLE,
-            CardCombination.FULLHOUSE,
-            CardCombination.STRAIGHT,
-            CardCombination.FOUROFAKIND,
-        ]
-        search_combinations: list[CardCombination] = [last_play.combination]
-        match last_play.combination:
-            case CardCombination.ANY:
-                search_combinations = all_combos
-            case CardCombination.FOUROFAKIND:
-                pass  # Do nothing extra
-            case _:
-                search_combinations.append(CardCombination.FOUROFAKIND)
-
+        if lazy:
+            return TurnContext(None, last_play, game_start, player=self)
+        self._sync_moves()
         moves: list[Play] = []
-        for c in search_combinations:
-            match c:
-                case CardCombination.SINGLE:
-                    begin_bound = self._find_first_viable_rank_(last_play)
-                    if begin_bound == -1:
-                        continue
-                    moves += [
-                        Play([self.hand[i]], c)
-                        for i in range(
-                            begin_bound,
-                            len(self.hand),
-                        )
-                    ]
-                case CardCombination.PAIR:
-                    moves += self._find_same_rank_combos_(last_play, 2)
-                case CardCombination.TRIPLE:
-                    moves += self._find_same_rank_combos_(last_play, 3)
-                case CardCombination.FULLHOUSE:
-                    # Only the triple matters, so any pair should be allowed
-                    pairs = self._find_same_rank_combos_(Play(), 2)
-                    triples = self._find_same_rank_combos_(
-                        Play(last_play.cards[2:], CardCombination.TRIPLE), 3
-                    )
-                    moves += [
-                        Play(p.cards + t.cards, c)
-                        for p in pairs
-                        for t in triples
-                        if p.cards[0].rank != t.cards[0].rank
-                    ]
-                case CardCombination.STRAIGHT:
-                    # Cursed dynamic sliding window
-                    if len(self.hand) < 5:
-                        continue
-                    i = (
-                        bisect_left(
-                            self.hand,
-                            Card(
-                                "Diamonds",
-                                str(
-                                    list(Card.ranks)[
-                                        max(last_play.cards).rank_index() - 4
-                                    ]
-                                ),
-                            ),
-                        )
-                        if len(last_play.cards)
-                        else 0
-                    )
-                    if i == len(self.hand):
-                        continue
-                    straight_buffer: deque[Card] = deque()
-                    straight_buffer.append(self.hand[i])
-                    i += 1
-                    while i < len(self.hand):
-                        if (
-                            self.hand[i].rank_index()
-                            - straight_buffer[0].rank_index()
-                            >= 5
-                            and straight_buffer[-1].rank_index()
-                            - straight_buffer[0].rank_index()
-                            == 4
-                        ):
-                            possible_plays = self._get_straight_combinations_(
-                                list(straight_buffer)
-                            )
-                            for p in possible_plays:
-                                if last_play < p:
-                                    moves.append(p)
-                            # Remove all instances of the first rank in deque
-                            rank_to_remove: str = straight_buffer[0].rank
-                            while straight_buffer[0].rank == rank_to_remove:
-                                straight_buffer.popleft()
-                        else:
-                            # Append to deque if rank is same or +1
-                            if (
-                                self.hand[i].rank_index()
-                                - straight_buffer[-1].rank_index()
-                                <= 1
-                            ):
-                                straight_buffer.append(self.hand[i])
-                            else:
-                                straight_buffer.clear()
-                                straight_buffer.append(self.hand[i])
-                            i += 1
-                    possible_plays = self._get_straight_combinations_(
-                        list(straight_buffer)
-                    )
-                    for p in possible_plays:
-                        if last_play < p:
-                            moves.append(p)
-                case CardCombination.FOUROFAKIND:
-                    moves += self._find_four_of_a_kinds_(last_play)
-        if game_start:
-            moves = [m for m in moves if Card("Diamonds", "3") in m.cards]
+        for c in search_combinations(last_play.combination):
+            # Only plays of the same combination have to beat last_play
+            min_key = last_play.key if c == last_play.combination else -1
+            moves += [
+                self._play(m, c, k)
+                for m, k in self._moves[c]
+                if k > min_key and (not game_start or m & THREE_OF_DIAMONDS)
+            ]
         return TurnContext(moves, last_play, game_start)
 
-    def _find_first_viable_rank_(self, last_play: Play) -> int:
+    def iter_plays(
+        self, last_play: Play = Play(), game_start=False, reverse=False
+    ) -> typing.Iterator[Play]:
         """
-        Return index of first valid card to be considered.
+        Yield the plays find_plays would return, building each on demand.
 
-        Returns 0 if all cards are viable.
-        Returns -1 if no cards are viable.
+        Plays come by combination, then by ascending strength, with ties
+        in find_plays order. If reverse is True, yield the exact reverse.
         """
-        if len(last_play.cards):
-            i = bisect_right(self.hand, max(last_play.cards))
-            if i == len(self.hand):
-                return -1
-            return i
-        else:
-            return 0
+        self._sync_moves()
+        combinations = search_combinations(last_play.combination)
+        for c in reversed(combinations) if reverse else combinations:
+            ranked = self._ranked.get(c)
+            if ranked is None:
+                ranked = self._ranked[c] = sorted(
+                    self._moves[c], key=lambda e: e[1]
+                )
+            min_key = last_play.key if c == last_play.combination else -1
+            # Plays that do not beat last_play sort before start
+            start = bisect_right(ranked, min_key, key=lambda e: e[1])
+            indices = range(start, len(ranked))
+            for i in reversed(indices) if reverse else indices:
+                m, k = ranked[i]
+                if not game_start or m & THREE_OF_DIAMONDS:
+                    yield self._play(m, c, k)
 
     def _find_same_rank_combos_(self, last_play: Play, n: int) -> list[Play]:
         assert (
@@ -181,74 +189,15 @@ class Player:
         combination = (
             CardCombination.PAIR if n == 2 else CardCombination.TRIPLE
         )
-        moves: list[Play] = []
-        i = self._find_first_viable_rank_(last_play)
-        if i == -1:
-            return []
-        same_rank: list[Card] = []
-        cur_rank = self.hand[i].rank
-        while i <= len(self.hand):
-            if i != len(self.hand) and self.hand[i].rank == cur_rank:
-                same_rank.append(self.hand[i])
-                i += 1
-            else:
-                if len(same_rank) >= n:
-                    combos = itertools.combinations(same_rank, n)
-                    for c in combos:
-                        moves.append(Play(list(c), combination))
-                if i == len(self.hand):
-                    break
-                same_rank.clear()
-                cur_rank = self.hand[i].rank
-        return moves
-
-    def _find_four_of_a_kinds_(self, last_play: Play) -> list[Play]:
-        moves: list[Play] = []
-        freq = Counter([c.rank for c in self.hand])
-        quad_ranks = [k for k, v in freq.items() if v == 4]
-        least_viable_rank_index: int = (
-            last_play.cards[-1].rank_index()
-            if (
-                len(last_play.cards)
-                and last_play.combination == CardCombination.FOUROFAKIND
-            )
-            else -1
-        )
-        for q_rank in quad_ranks:
-            # Skip quads with lower ranks than last_play
-            if Card.ranks[q_rank] < least_viable_rank_index:
-                continue
-            q_idx = bisect_left(self.hand, Card("Diamonds", q_rank))
-            quad = self.hand[q_idx : q_idx + 4]
-            i: int = 0
-            while i < len(self.hand):
-                if i == q_idx:
-                    i += 4
-                    continue
-                moves.append(
-                    Play(quad + [self.hand[i]], CardCombination.FOUROFAKIND)
-                )
-                i += 1
-        return moves
-
-    def _get_straight_combinations_(self, cards: Cards) -> list[Play]:
-        def backtrack(hand: Cards, remaining: Cards):
-            if len(hand) == 5 and is_straight(hand):
-                results.append(Play(hand, CardCombination.STRAIGHT))
-                return
-            if not remaining:
-                return
-            for i, card in enumerate(remaining):
-                rank = card.rank
-                if rank not in selected_ranks:
-                    selected_ranks.add(rank)
-                    backtrack(hand + [card], remaining[i + 1 :])
-                    selected_ranks.remove(rank)
-
-        results: list[Play] = []
-        selected_ranks: set[str] = set()
-        backtrack([], cards)
-        return results
+        return [
+            mask2play(m, combination)
+            for m in same_rank_masks(cards2mask(self.hand), n)
+            if highest(m) > last_play.key
+        ]
+
+    def remove_cards(self, cards: int):
+        """Remove the bitmask of cards from hand."""
+        self.hand = mask2cards(remove(cards2mask(self.hand), cards))
 
     def make_play(self, ctx: TurnContext) -> Play:
         """Play a combination and remove cards from hand."""
@@ -312,8 +261,7 @@ class HumanPlayer(Player):
                     continue
 
                 # Remove the played cards from the hand
-                for card in selected_cards:
-                    self.hand.remove(card)
+                self.remove_cards(cards2mask(selected_cards))
 
                 return play
 
@@ -328,9 +276,9 @@ class HumanPlayer(Player):
 class AggressivePlayer(Player):
     def make_play(self, ctx: TurnContext) -> Play:
         """Play the most aggressive combination."""
-        if not ctx.available_plays:
+        chosen_play: Play | None = next(ctx.iter_plays(reverse=True), None)
+        if chosen_play is None:
             return Play([], CardCombination.PASS)
-        chosen_play: Play = ctx.available_plays[-1]
         return chosen_play
 
 
@@ -386,10 +334,24 @@ class RLAgent(Player):
         epsilon_decay=1 / 5e8,
         final_epsilon=0.1,
         gamma: float = 0.9,
+        replay_capacity: int = 0,
+        n_step: int = 1,
+        batch_size: int = 32,
+        update_every: int = 4,
+        encoder: ObservationEncoder | None = None,
     ):
+        """
+        encoder keys the Q table by observations, exactly by default.
+
+        With replay_capacity > 0, update() stores transitions in a replay
+        buffer of that size instead of learning from them right away, and
+        learns from a batch of batch_size n_step transitions every
+        update_every steps.
+        """
         super().__init__(name=name, hand=hand, id=id)
 
-        self.q_values = defaultdict(lambda: defaultdict(float))
+        # load_agent() swaps in a FrozenQTable, which cannot be trained
+        self.q_values: QValues = QTable()
         self.alpha = alpha
         self.epsilon = initial_epsilon
         self.epsilon_decay = epsilon_decay
@@ -398,15 +360,32 @@ class RLAgent(Player):
         self.play_history: list[Play] = []
         self.last_state_action_q = ()
         self.current_episode: int = 1
-
-    def make_obs_hashable(self, obs):
-        return (
-            obs[0],
-            tuple(obs[1]),
-        )
+        self.replay: ReplayBuffer | None = None
+        if replay_capacity > 0:
+            self.replay = ReplayBuffer(replay_capacity, n_step, gamma)
+        self.batch_size = batch_size
+        self.update_every = update_every
+        self.steps: int = 0
+        self.encoder = ObservationEncoder() if encoder is None else encoder
+
+    def trainable_q_values(self) -> QTable:
+        """Return the Q table, which must not be frozen."""
+        assert isinstance(
+            self.q_values, QTable
+        ), "A frozen Q table cannot be trained, load it with QTable.load"
+        return self.q_values
+
+    def make_obs_hashable(self, obs) -> int:
+        return self.encoder(obs)
 
     def make_play(self, ctx: TurnContext, obs=None) -> Play:
-        assert obs
+        """Pick a play for obs and keep it as ctx.chosen."""
+        ctx.chosen = self._pick_play(ctx, obs)
+        return ctx.chosen
+
+    def _pick_play(self, ctx: TurnContext, obs) -> Play:
+        assert obs is not None
+        action_key = self.encoder.action_keys(obs)
         obs = self.make_obs_hashable(obs)
         if not ctx.available_plays:
             # Forced to pass
@@ -414,45 +393,113 @@ class RLAgent(Player):
         if np.random.random() < self.epsilon:
             # Random action
             return super().make_play(ctx)
-        if obs not in self.q_values:
-            chosen_play = super().make_play(ctx)
-        else:
-            q_obs = self.q_values[obs]
-            best_q: float = max(q_obs.values())
-            best_actions: list[int] = [
-                k for k, v in q_obs.items() if v == best_q
-            ]
-            best_action: int = random.choice(best_actions)
-            key_card, key_combination = discrete2playlike(best_action)
-            if key_combination == CardCombination.PASS:
-                return Play(combination=CardCombination.PASS)
-            best_plays: list[Play] = [
-                p
-                for p in ctx.available_plays
-                if p.combination == key_combination and p.cards[-1] == key_card
-            ]
-            chosen_play = best_plays[0]
+        q_obs = self.q_values.get(obs)
+        if q_obs is None:
+            return self._remember(super().make_play(ctx))
+        # Passing is always allowed, its Play is only built if chosen
+        plays: dict[int, Play | None] = {action_key(0): None}
+        # The first play of each action, like a scan of available_plays
+        plays |= {action_key(p.mask): p for p in reversed(ctx.available_plays)}
+        best_action = q_obs.best_action(plays)
+        if best_action is None:
+            return self._remember(super().make_play(ctx))
+        chosen_play = plays[best_action]
+        if chosen_play is None:
+            return Play(combination=CardCombination.PASS)
+        return self._remember(chosen_play)
+
+    def _remember(self, play: Play) -> Play:
+        """Add play to play_history unless it is a pass."""
+        if play.combination != CardCombination.PASS:
+            self.play_history.append(play)
+        return play
+
+    def act(self, obs, action_mask) -> int:
+        """
+        Pick a discrete action for obs among the legal ones in action_mask.
 
-        if chosen_play.combination != CardCombination.PASS:
-            self.play_history.append(chosen_play)
-        return chosen_play
+        Like make_play, explore with probability epsilon and otherwise take
+        the best known action.
+        """
+        assert (
+            not self.encoder.relabels
+        ), "Relabelled actions need their plays, use make_play"
+        legal: list[int] = np.flatnonzero(action_mask).tolist()
+        q_obs = self.q_values.get(self.make_obs_hashable(obs))
+        if np.random.random() < self.epsilon or q_obs is None:
+            return random.choice(legal)
+        best_action = q_obs.best_action(set(legal))
+        return random.choice(legal) if best_action is None else best_action
+
+    def encode_action(self, obs, action: int, play: Play | None = None) -> int:
+        """
+        Return action as it is keyed in the state of obs. Encoders that
+        relabel actions need the play that was made.
+        """
+        if not self.encoder.relabels:
+            return action
+        assert play is not None, "Relabelled actions need their play"
+        return self.encoder.action_keys(obs)(play.mask)
+
+    def update(
+        self,
+        obs,
+        action: int,
+        reward,
+        done: bool,
+        next_obs,
+        info,
+        play: Play | None = None,
+    ):
+        """
+        Update internal Q table. Handle winning rounds and games.
 
-    def update(self, obs, action: int, reward, done: bool, next_obs, info):
-        """Update internal Q table. Handle winning rounds and games."""
+        play is the play made, see encode_action.
+        """
+        q_values = self.trainable_q_values()
+        action = self.encode_action(obs, action, play)
         obs = self.make_obs_hashable(obs)
-        next_obs = self.make_obs_hashable(next_obs)
-        q_next_obs = 0
-        if next_obs in self.q_values.keys():
-            q_next_obs = max(self.q_values[next_obs].values())
-        future_q_value = (not done) * q_next_obs
+        next_state = self.make_obs_hashable(next_obs)
+        if self.replay is not None:
+            self.replay.add(obs, action, reward, done, next_state)
+            self.steps += 1
+            if (
+                self.steps % self.update_every == 0
+                and len(self.replay) >= self.batch_size
+            ):
+                self.learn(self.replay.sample(self.batch_size))
+            return
+        future_q_value = 0.0
+        q_next_obs = None if done else q_values.get(next_state)
+        if q_next_obs is not None:
+            # States shared by several hands hold actions this one lacks
+            legal = self.encoder.legal_keys(next_obs)
+            future_q_value = max(
+                (v for a, v in q_next_obs.items() if a in legal), default=0.0
+            )
         temporal_difference = (
-            reward + self.gamma * future_q_value - self.q_values[obs][action]
+            reward + self.gamma * future_q_value - q_values[obs][action]
         )
 
-        self.q_values[obs][action] = (
-            self.q_values[obs][action] + self.alpha * temporal_difference
+        q_values[obs][action] = (
+            q_values[obs][action] + self.alpha * temporal_difference
         )
 
+    def learn(self, batch: Batch):
+        """
+        Apply the TD updates of a batch of transitions at once.
+
+        All updates are computed from the values before the batch, those
+        of the same state and action add up.
+        """
+        q_values = self.trainable_q_values()
+        states, actions, rewards, dones, next_states, discounts = batch
+        entries = q_values.entries(states, actions)
+        future = np.where(dones, 0.0, q_values.max_values(next_states))
+        values = np.frombuffer(q_values.values)
+        temporal_differences = rewards + discounts * future - values[entries]
+        np.add.at(values, entries, self.alpha * temporal_differences)
+
     def decay_epsilon(self):
         self.epsilon = self.final_epsilon + (
             self.epsilon - self.final_epsilon
@@ -465,3 +512,4 @@ class PlayerType(Enum):
     Aggressive = 1
     PlayItSafe = 2
     RLAgent = 3
+    MCTS = 4
@@ -0,0 +1,18 @@
+"""
+Sizing of the process pools that evaluation and search fan out to.
+"""
+
+import multiprocessing
+import os
+
+
+def pool_size(workers: int | None, jobs: int | None = None) -> int:
+    """
+    Return how many processes to run jobs on: workers, all cores if None,
+    and no more than jobs.
+    """
+    # Pool workers are daemons, which cannot start a pool of their own
+    if multiprocessing.current_process().daemon:
+        return 1
+    workers = workers or os.cpu_count() or 1
+    return workers if jobs is None else min(workers, jobs)
@@ -0,0 +1,439 @@
+"""
+Compact Q table for RLAgent.
+
+States are packed into a single int, the hand bitmask above the 9 bits of
+the discrete last play. The actions a state has values for, and those
+values, live in slices of two flat arrays shared by every state, in the
+order they were first set. A state that outgrows its slice moves to the
+end of the arrays with twice the room.
+
+Saved tables hold the state keys in ascending order and the action values
+of each state as rows of a sparse matrix, so FrozenQTable can serve them
+read-only straight from a memory map.
+"""
+
+from array import array
+import math
+from typing import Protocol
+import numpy as np
+
+# Bits taken by the discrete last play, play2discrete is at most 313
+LAST_PLAY_BITS = 9
+# Room a new state gets for its actions
+INITIAL_CAPACITY = 4
+
+QTABLE_MAGIC = int.from_bytes(b"BIGTWOQT", "little")
+QTABLE_VERSION = 1
+# magic, version, number of states, number of state action pairs
+HEADER_SIZE = 4 * 8
+
+
+def state_key(last_play: int, hand) -> int:
+    """Pack a discrete last play and a hand box into a state key."""
+    packed = np.packbits(np.asarray(hand, dtype=bool), bitorder="little")
+    hand_mask = int.from_bytes(packed.tobytes(), "little")
+    return hand_mask << LAST_PLAY_BITS | int(last_play)
+
+
+def unpack_state(state: int) -> tuple[int, int]:
+    """Return the discrete last play and hand bitmask of a state key."""
+    return state & (1 << LAST_PLAY_BITS) - 1, state >> LAST_PLAY_BITS
+
+
+def _best_action(actions, values, legal) -> int | None:
+    """
+    Return the best valued action in legal, ties broken at random, None
+    if no action is legal.
+    """
+    best_value = -math.inf
+    best: list[int] = []
+    for action, value in zip(actions, values):
+        if action not in legal or value < best_value:
+            continue
+        if value > best_value:
+            best_value = value
+            best = [action]
+        else:
+            best.append(action)
+    if len(best) <= 1:
+        return best[0] if best else None
+    return best[np.random.randint(len(best))]
+
+
+class QRow:
+    """
+    The action values of one state of a QTable.
+
+    Behaves like the defaultdict(float) it replaces: reading a missing
+    action adds it with value 0.0.
+    """
+
+    __slots__ = ("table", "row")
+
+    def __init__(self, table: "QTable", row: int):
+        self.table = table
+        self.row = row
+
+    def _bounds(self) -> tuple[int, int]:
+        start = self.table.starts[self.row]
+        return start, start + self.table.sizes[self.row]
+
+    def _find(self, action: int) -> int:
+        """Return where action is in the table's arrays, -1 if missing."""
+        table = self.table
+        start = table.starts[self.row]
+        end = start + table.sizes[self.row]
+        if action not in table.actions[start:end]:
+            return -1
+        return table.actions.index(action, start, end)
+
+    def __len__(self) -> int:
+        return self.table.sizes[self.row]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, action: int) -> bool:
+        return self._find(action) >= 0
+
+    def __getitem__(self, action: int) -> float:
+        i = self._find(action)
+        if i < 0:
+            self.table._append(self.row, action, 0.0)
+            return 0.0
+        return self.table.values[i]
+
+    def __setitem__(self, action: int, value: float):
+        i = self._find(action)
+        if i < 0:
+            self.table._append(self.row, action, value)
+        else:
+            self.table.values[i] = value
+
+    def get(self, action: int, default=None):
+        i = self._find(action)
+        return default if i < 0 else self.table.values[i]
+
+    def keys(self) -> array:
+        start, end = self._bounds()
+        return self.table.actions[start:end]
+
+    def values(self) -> array:
+        start, end = self._bounds()
+        return self.table.values[start:end]
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def update(self, values: dict[int, float]):
+        for action, value in values.items():
+            self[action] = value
+
+    def best_actions(self) -> list[int]:
+        """Return the actions with the highest value, in insertion order."""
+        values = self.values()
+        best = max(values)
+        return [a for a, v in zip(self.keys(), values) if v == best]
+
+    def best_action(self, legal) -> int | None:
+        """Return a best action in legal, see _best_action."""
+        return _best_action(self.keys(), self.values(), legal)
+
+
+class QTable:
+    """
+    Q values of RLAgent keyed by state_key.
+
+    Indexing a state returns its QRow, adding the state if it is missing,
+    like the defaultdict(lambda: defaultdict(float)) it replaces.
+    """
+
+    def __init__(self):
+        self.rows: dict[int, int] = {}  # state key -> row
+        # Where each row's slice starts, its length and its room
+        self.starts = array("q")
+        self.sizes = array("H")
+        self.capacities = array("H")
+        self.actions = array("h")
+        self.values = array("d")
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __contains__(self, state: int) -> bool:
+        return state in self.rows
+
+    def __getitem__(self, state: int) -> QRow:
+        row = self.rows.get(state)
+        if row is None:
+            row = self._add_state(state)
+        return QRow(self, row)
+
+    def get(self, state: int, default=None):
+        row = self.rows.get(state)
+        return default if row is None else QRow(self, row)
+
+    def keys(self):
+        return self.rows.keys()
+
+    def items(self):
+        return ((state, QRow(self, row)) for state, row in self.rows.items())
+
+    def num_actions(self) -> int:
+        """Return how many state action pairs have a value."""
+        return sum(self.sizes)
+
+    def entries(self, states, actions) -> np.ndarray:
+        """
+        Return where the values of states and actions are in values,
+        adding the missing ones with value 0.0.
+        """
+        pairs = list(
+            zip(np.asarray(states).tolist(), np.asarray(actions).tolist())
+        )
+        # Adding may move rows, so only look entries up after all are added
+        for state, action in pairs:
+            row = self[state]
+            if action not in row:
+                row[action] = 0.0
+        return np.array(
+            [self[state]._find(action) for state, action in pairs],
+            dtype=np.int64,
+        )
+
+    def max_values(self, states) -> np.ndarray:
+        """Return the best value of each state, 0.0 for unknown states."""
+        rows = np.array(
+            [self.rows.get(s, -1) for s in np.asarray(states).tolist()],
+            dtype=np.int64,
+        )
+        best = np.zeros(len(rows))
+        sizes = np.zeros(len(rows), dtype=np.int64)
+        if len(self.rows):
+            table_sizes = np.frombuffer(self.sizes, dtype=np.uint16)
+            sizes[rows >= 0] = table_sizes[rows[rows >= 0]]
+        known = sizes > 0
+        if not known.any():
+            return best
+        starts = np.frombuffer(self.starts, dtype=np.int64)[rows[known]]
+        sizes = sizes[known]
+        # Gather the values of every row, padded to the longest one
+        cols = np.arange(sizes.max())
+        entries = (starts[:, None] + cols).clip(max=len(self.values) - 1)
+        values = np.frombuffer(self.values)[entries]
+        best[known] = np.where(cols < sizes[:, None], values, -np.inf).max(
+            axis=1
+        )
+        return best
+
+    def _add_state(self, state: int) -> int:
+        row = len(self.starts)
+        self.rows[state] = row
+        self.starts.append(len(self.actions))
+        self.sizes.append(0)
+        self.capacities.append(INITIAL_CAPACITY)
+        self.actions.extend(array("h", [-1]) * INITIAL_CAPACITY)
+        self.values.extend(array("d", [0.0]) * INITIAL_CAPACITY)
+        return row
+
+    def _append(self, row: int, action: int, value: float):
+        start, size = self.starts[row], self.sizes[row]
+        if size == self.capacities[row]:
+            # Move the row to the end with twice the room
+            actions = self.actions[start : start + size]
+            values = self.values[start : start + size]
+            capacity = max(2 * size, INITIAL_CAPACITY)
+            self.starts[row] = start = len(self.actions)
+            self.capacities[row] = capacity
+            self.actions += actions + array("h", [-1]) * (capacity - size)
+            self.values += values + array("d", [0.0]) * (capacity - size)
+        self.actions[start + size] = action
+        self.values[start + size] = value
+        self.sizes[row] = size + 1
+
+    def save(self, path: str):
+        """
+        Save the table to path in the format FrozenQTable reads.
+
+        The file is a header followed by the state keys in ascending
+        order, where each state's actions and values start (num_states + 1
+        offsets), then the actions and values of every state in key order.
+        """
+        keys = np.fromiter(self.rows, dtype=np.uint64, count=len(self.rows))
+        rows = np.fromiter(
+            self.rows.values(), dtype=np.int64, count=len(self.rows)
+        )
+        order = np.argsort(keys)
+        keys, rows = keys[order], rows[order]
+        starts = np.frombuffer(self.starts, dtype=np.int64)[rows]
+        sizes = np.frombuffer(self.sizes, dtype=np.uint16)[rows]
+        offsets = np.zeros(len(keys) + 1, dtype=np.uint64)
+        np.cumsum(sizes, out=offsets[1:])
+        # Pool index of every state action pair, in key order
+        entries = np.repeat(starts - offsets[:-1].astype(np.int64), sizes)
+        entries += np.arange(len(entries))
+        header = [QTABLE_MAGIC, QTABLE_VERSION, len(keys), len(entries)]
+        with open(path, "wb") as f:
+            f.write(np.array(header, dtype="<u8").tobytes())
+            f.write(keys.astype("<u8").tobytes())
+            f.write(offsets.astype("<u8").tobytes())
+            f.write(
+                np.frombuffer(self.values, "d")[entries]
+                .astype("<f8")
+                .tobytes()
+            )
+            f.write(
+                np.frombuffer(self.actions, "h")[entries]
+                .astype("<i2")
+                .tobytes()
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "QTable":
+        """Load a saved table into a QTable that can keep training."""
+        frozen = FrozenQTable(path)
+        table = cls()
+        table.rows = dict(zip(frozen.states.tolist(), range(len(frozen))))
+        for name, values in (
+            ("starts", frozen.offsets[:-1]),
+            ("sizes", np.diff(frozen.offsets)),
+            ("capacities", np.diff(frozen.offsets)),
+            ("actions", frozen.actions),
+            ("values", frozen.values),
+        ):
+            pool = getattr(table, name)
+            pool.frombytes(values.astype(pool.typecode).tobytes())
+        return table
+
+
+class FrozenQRow:
+    """The action values of one state of a FrozenQTable."""
+
+    __slots__ = ("actions", "action_values")
+
+    def __init__(self, actions: np.ndarray, values: np.ndarray):
+        self.actions = actions
+        self.action_values = values
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, action: int) -> bool:
+        return bool((self.actions == action).any())
+
+    def __getitem__(self, action: int) -> float:
+        value = self.get(action)
+        if value is None:
+            raise KeyError(action)
+        return value
+
+    def get(self, action: int, default=None):
+        i = np.flatnonzero(self.actions == action)
+        return float(self.action_values[i[0]]) if len(i) else default
+
+    def keys(self) -> list[int]:
+        return self.actions.tolist()
+
+    def values(self) -> list[float]:
+        return self.action_values.tolist()
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def best_actions(self) -> list[int]:
+        """Return the actions with the highest value, in insertion order."""
+        return self.actions[
+            self.action_values == self.action_values.max()
+        ].tolist()
+
+    def best_action(self, legal) -> int | None:
+        """Return a best action in legal, see _best_action."""
+        return _best_action(self.keys(), self.values(), legal)
+
+
+class FrozenQTable:
+    """
+    A saved QTable, served read-only from a memory map.
+
+    Processes that open the same file share its pages, so a table is
+    loaded instantly whatever its size. States are found by binary search
+    over the sorted keys.
+    """
+
+    def __init__(self, path: str):
+        header = np.fromfile(path, dtype="<u8", count=4)
+        assert len(header) == 4 and header[0] == QTABLE_MAGIC, "Not a Q table"
+        assert header[1] == QTABLE_VERSION, "Unsupported Q table version"
+        num_states, num_entries = int(header[2]), int(header[3])
+        offset = HEADER_SIZE
+        sections = []
+        for dtype, count in (
+            ("<u8", num_states),
+            ("<u8", num_states + 1),
+            ("<f8", num_entries),
+            ("<i2", num_entries),
+        ):
+            if count == 0:
+                sections.append(np.zeros(0, dtype=dtype))
+            else:
+                # Plain arrays over the mapped pages index faster
+                mapped = np.memmap(
+                    path, dtype, "r", offset=offset, shape=count
+                )
+                sections.append(mapped.view(np.ndarray))
+            offset += np.dtype(dtype).itemsize * count
+        self.states, self.offsets, self.values, self.actions = sections
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def _row(self, state: int) -> int:
+        """Return the row of state, -1 if it is missing."""
+        i = int(self.states.searchsorted(np.uint64(state)))
+        return i if i < len(self.states) and self.states[i] == state else -1
+
+    def __contains__(self, state: int) -> bool:
+        return self._row(state) >= 0
+
+    def __iter__(self):
+        return iter(self.states.tolist())
+
+    def keys(self) -> list[int]:
+        return self.states.tolist()
+
+    def __getitem__(self, state: int) -> FrozenQRow:
+        row = self.get(state)
+        if row is None:
+            raise KeyError(state)
+        return row
+
+    def get(self, state: int, default=None):
+        i = self._row(state)
+        if i < 0:
+            return default
+        start, end = self.offsets[i : i + 2].tolist()
+        return FrozenQRow(self.actions[start:end], self.values[start:end])
+
+    def items(self):
+        return ((state, self[state]) for state in self)
+
+    def num_actions(self) -> int:
+        return len(self.actions)
+
+
+class QValues(Protocol):
+    """The Q values an RLAgent plays with, a QTable or a FrozenQTable."""
+
+    def __len__(self) -> int: ...
+
+    def __contains__(self, state: int) -> bool: ...
+
+    def get(self, state: int, default=None) -> "QRow | FrozenQRow | None": ...
+
+    def num_actions(self) -> int: ...
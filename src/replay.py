@@ -0,0 +1,95 @@
+"""
+Experience replay for RLAgent.
+
+Transitions are kept in a fixed capacity ring of numpy arrays, keyed by
+QTable state keys, and replayed in random batches. With n_step > 1 each
+stored transition carries the discounted reward of up to n steps and the
+state reached after them.
+"""
+
+from collections import deque
+import numpy as np
+
+# The arrays of a batch of transitions, in this order
+Batch = tuple[
+    np.ndarray,  # states, uint64 state keys
+    np.ndarray,  # actions
+    np.ndarray,  # rewards, discounted over up to n steps
+    np.ndarray,  # dones
+    np.ndarray,  # next_states, the state keys after those steps
+    np.ndarray,  # discounts, gamma ** steps for the next state's value
+]
+
+
+class ReplayBuffer:
+    """Keep the last capacity transitions and sample batches of them."""
+
+    def __init__(self, capacity: int = 100000, n_step: int = 1, gamma=0.9):
+        assert capacity > 0 and n_step > 0
+        self.capacity = capacity
+        self.n_step = n_step
+        self.gamma = gamma
+        self.states = np.zeros(capacity, dtype=np.uint64)
+        self.actions = np.zeros(capacity, dtype=np.int16)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.next_states = np.zeros(capacity, dtype=np.uint64)
+        self.discounts = np.zeros(capacity, dtype=np.float64)
+        self.position = 0  # Where the next transition goes
+        self.size = 0
+        # (state, action, reward) of the last steps not stored yet
+        self.pending: deque[tuple[int, int, float]] = deque()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(
+        self,
+        state: int,
+        action: int,
+        reward: float,
+        done: bool,
+        next_state: int,
+    ):
+        """
+        Add one environment step.
+
+        The step is stored once n_step steps follow it or the episode ends,
+        which stores every step still pending.
+        """
+        self.pending.append((state, action, reward))
+        if done:
+            while self.pending:
+                self._store(True, next_state)
+        elif len(self.pending) == self.n_step:
+            self._store(False, next_state)
+
+    def _store(self, done: bool, next_state: int):
+        """Store the oldest pending step, with the rewards after it."""
+        state, action, _ = self.pending[0]
+        reward = sum(
+            self.gamma**i * r for i, (_, _, r) in enumerate(self.pending)
+        )
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.dones[i] = done
+        self.next_states[i] = next_state
+        self.discounts[i] = self.gamma ** len(self.pending)
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.pending.popleft()
+
+    def sample(self, batch_size: int) -> Batch:
+        """Return batch_size transitions drawn uniformly with replacement."""
+        assert self.size > 0, "Nothing to sample"
+        i = np.random.randint(self.size, size=batch_size)
+        return (
+            self.states[i],
+            self.actions[i],
+            self.rewards[i],
+            self.dones[i],
+            self.next_states[i],
+            self.discounts[i],
+        )
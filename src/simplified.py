@@ -1,8 +1,8 @@
-from main import *
+from catalogue import get_catalogue
 
 s = set()
-p = Player("", Deck().cards)
-plays = p.find_plays(Play())
+catalogue = get_catalogue()
+plays = [catalogue.play(i) for i in range(len(catalogue))]
 print(f"Total number of possible plays = {len(plays)}")
 
 for play in plays:
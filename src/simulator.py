@@ -0,0 +1,297 @@
+"""
+Batched Big Two simulator for games between the heuristic players.
+
+Many games advance in lockstep on array state, one turn of every
+unfinished game per step. Plays are catalogue ids and each PlayerType
+has a policy that picks plays for all games where it is that type's turn
+at once, the way its Player subclass would.
+"""
+
+import functools
+import numpy as np
+from batch import boxes2masks, legal_plays
+from bitmask import NUM_CARDS
+from card import Card, CardCombination
+from catalogue import ANY_ID, PASS_ID, get_catalogue
+from player import PlayerType
+
+# Policies get (n, K) arrays of candidate play ids, in ascending id order,
+# whether each is legal and n uniform random numbers, one per game. Every
+# row has a legal play.
+
+
+def random_policy(
+    plays: np.ndarray, legal: np.ndarray, uniforms: np.ndarray
+) -> np.ndarray:
+    """Pick a legal play uniformly at random, like Player."""
+    rows, cols = np.nonzero(legal)
+    counts = np.bincount(rows, minlength=len(legal))
+    picks = (uniforms * counts).astype(np.int64)
+    i = np.cumsum(counts) - counts + picks
+    return plays[rows[i], cols[i]]
+
+
+def aggressive_policy(plays: np.ndarray, legal: np.ndarray, uniforms=None):
+    """Pick the strongest legal play, like AggressivePlayer."""
+    strengths = np.where(legal, get_catalogue().strengths[plays], -1)
+    return plays[np.arange(len(plays)), strengths.argmax(axis=1)]
+
+
+@functools.cache
+def _play_it_safe_features() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Return, for every play, the rank of its first card, its size and
+    whether it has a card above 9.
+    """
+    catalogue = get_catalogue()
+    counts = catalogue.rank_counts
+    # Full houses start with the pair, four of a kinds with the kicker
+    first_count = np.select(
+        [
+            catalogue.combinations == CardCombination.FULLHOUSE.value,
+            catalogue.combinations == CardCombination.FOUROFAKIND.value,
+        ],
+        [2, 1],
+        0,
+    )
+    first_ranks = np.where(
+        first_count > 0,
+        (counts == first_count[:, None]).argmax(axis=1),
+        (counts > 0).argmax(axis=1),
+    )
+    sizes = counts.sum(axis=1)
+    good = np.asarray((counts[:, Card.ranks["9"] + 1 :] > 0).any(axis=1))
+    return first_ranks, sizes, good
+
+
+def play_it_safe_policy(plays: np.ndarray, legal: np.ndarray, uniforms=None):
+    """
+    Pick the play PlayItSafePlayer would, scanning in find_plays order.
+
+    Among the plays before the first four of a kind, the first play with
+    the most cards of the weakest play's lowest rank is taken. Later plays
+    with as many such cards replace it only when they are longer and have
+    no card above 9, so the longest of those wins, the first one on ties.
+    """
+    catalogue = get_catalogue()
+    first_ranks, sizes, good = _play_it_safe_features()
+    rows = np.arange(len(plays))
+    cols = np.arange(plays.shape[1])
+    weakest = plays[rows, legal.argmax(axis=1)]
+    counts = catalogue.rank_counts[plays, first_ranks[weakest][:, None]]
+    # Avoid starting a round with four of a kind
+    scanned = legal & (
+        catalogue.combinations[plays] != CardCombination.FOUROFAKIND.value
+    )
+    most = np.where(scanned, counts, -1).max(axis=1)
+    candidates = scanned & (counts == most[:, None])
+    first = candidates.argmax(axis=1)[:, None]
+    candidates &= (cols > first) & ~good[plays] | (cols == first)
+    sizes = np.where(candidates, sizes[plays], 0)
+    chosen = plays[rows, sizes.argmax(axis=1)]
+    return np.where(scanned.any(axis=1), chosen, weakest)
+
+
+POLICIES = {
+    PlayerType.Random: random_policy,
+    PlayerType.Aggressive: aggressive_policy,
+    PlayerType.PlayItSafe: play_it_safe_policy,
+}
+
+
+class BatchedBigTwoSimulator:
+    """
+    Play num_games games between heuristic players in lockstep.
+
+    Seat i of every game is played by player_types[i]. Game state is kept
+    as arrays over the games: hands (num_games, players, 52), the last
+    play id (ANY_ID at the start of a round), passes and current player.
+    The plays of every dealt hand are listed once, so turns only check
+    those against the cards left and the last play.
+
+    Every game has its own random stream for dealing and random players.
+    Seats of other types (RLAgent) are not played by step(), their plays
+    are passed to play() instead.
+    """
+
+    def __init__(
+        self,
+        player_types: list[PlayerType],
+        num_games: int,
+        seed: int | None = None,
+    ):
+        assert 2 <= len(player_types) <= 4
+        self.player_types = list(player_types)
+        self.num_games = num_games
+        self.seed(seed)
+        num_players = len(self.player_types)
+        self.hands = np.zeros((num_games, num_players, NUM_CARDS), dtype=bool)
+        self.hand_masks = np.zeros((num_games, num_players), dtype=np.uint64)
+        self.plays = np.full((num_games, num_players, 0), -1, dtype=np.int16)
+        self.last_play = np.full(num_games, ANY_ID)
+        self.passes = np.zeros((num_games, num_players), dtype=bool)
+        self.current_player = np.zeros(num_games, dtype=np.int64)
+        self.turns = np.zeros(num_games, dtype=np.int64)
+        self.winner = np.full(num_games, -1)
+        self.setup()
+
+    def seed(self, seed: int | None = None, games=None):
+        """
+        Seed the random streams of games, all by default.
+
+        Game i of games gets seed + i, an unseeded stream if seed is None.
+        """
+        if games is None:
+            self.randoms: list[np.random.Generator] = [
+                np.random.default_rng(None if seed is None else seed + i)
+                for i in range(self.num_games)
+            ]
+            return
+        for i, g in enumerate(games):
+            self.randoms[g] = np.random.default_rng(
+                None if seed is None else seed + i
+            )
+
+    def setup(self, games=None):
+        """Deal new hands to games, all by default."""
+        games = np.arange(self.num_games) if games is None else games
+        num_players = len(self.player_types)
+        # Remove some cards from the deck for 2 players
+        dealt = 42 if num_players == 2 else NUM_CARDS
+        decks = np.empty((len(games), dealt), dtype=np.int64)
+        for i, g in enumerate(games):
+            deck = self.randoms[g].permutation(NUM_CARDS)[:dealt]
+            # The 3 of Diamonds must be dealt
+            while not (deck == 0).any():
+                deck = self.randoms[g].permutation(NUM_CARDS)[:dealt]
+            decks[i] = deck
+
+        self.hands[games] = False
+        self.hands[games[:, None], np.arange(dealt) % num_players, decks] = 1
+        self.hand_masks[games] = boxes2masks(self.hands[games])
+        self.last_play[games] = ANY_ID
+        self.passes[games] = False
+        # The player with the 3 of Diamonds starts
+        self.current_player[games] = self.hands[games, :, 0].argmax(axis=1)
+        self.turns[games] = 0
+        self.winner[games] = -1
+        self._list_plays(games)
+
+    def _list_plays(self, games):
+        """
+        List the plays of the dealt hands of games in plays, a
+        (num_games, players, K) array of play ids padded with -1.
+        """
+        hands = self.hand_masks[games].ravel()
+        rows, ids = np.nonzero(
+            legal_plays(hands, CardCombination.ANY.value, -1)
+        )
+        counts = np.bincount(rows, minlength=len(hands))
+        width = max(counts.max(), self.plays.shape[2])
+        if width > self.plays.shape[2]:
+            padding = width - self.plays.shape[2]
+            self.plays = np.pad(
+                self.plays, ((0, 0), (0, 0), (0, padding)), constant_values=-1
+            )
+        cols = np.arange(len(rows)) - (np.cumsum(counts) - counts)[rows]
+        plays = np.full((len(hands), width), -1, dtype=np.int16)
+        plays[rows, cols] = ids
+        self.plays[games] = plays.reshape(len(games), -1, width)
+
+    def start_rounds(self, games) -> np.ndarray:
+        """
+        Start a new round in games where all other players passed in a
+        row, return which did.
+        """
+        passes = self.passes[games]
+        current = self.current_player[games]
+        new_round = passes.sum(axis=1) - passes[
+            np.arange(len(games)), current
+        ] == (len(self.player_types) - 1)
+        self.last_play[games[new_round]] = ANY_ID
+        self.passes[games[new_round]] = False
+        return new_round
+
+    def legal_plays(self, games) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the candidate plays of the current players of games and
+        which of them are legal, as (len(games), K) arrays.
+        """
+        catalogue = get_catalogue()
+        current = self.current_player[games]
+        plays = self.plays[games, current]
+        missing = ~self.hand_masks[games, current][:, None]
+        legal = (plays >= 0) & (catalogue.masks[plays] & missing == 0)
+        beats = catalogue.beats_row_ids(self.last_play[games])
+        legal &= catalogue.beats_table[beats[:, None], plays]
+        # The first play must have the 3 of Diamonds
+        legal &= (self.turns[games] > 0)[:, None] | catalogue.game_starts[
+            plays
+        ]
+        return plays, legal
+
+    def play(self, games, chosen) -> np.ndarray:
+        """
+        Make the current players of games play the chosen play ids
+        (PASS_ID to pass) and return which games they won.
+        """
+        catalogue = get_catalogue()
+        current = self.current_player[games]
+        played = chosen != PASS_ID
+        g, p, ids = games[played], current[played], chosen[played]
+        self.hands[g, p] &= ~catalogue.boxes[ids]
+        self.hand_masks[g, p] &= ~catalogue.masks[ids]
+        self.last_play[g] = ids
+        self.passes[games, current] = ~played
+
+        won = self.hand_masks[games, current] == 0
+        self.winner[games[won]] = current[won]
+        self.current_player[games] = np.where(
+            won, current, (current + 1) % len(self.player_types)
+        )
+        self.turns[games] += 1
+        return won
+
+    def step(self, games=None) -> np.ndarray:
+        """
+        Play one turn of the unfinished games, all by default, where a
+        heuristic player is to play. Return the plays of those games.
+        """
+        games = np.arange(self.num_games) if games is None else games
+        types = np.array([t.value for t in self.player_types])
+        games = games[
+            (self.winner[games] < 0)
+            & np.isin(
+                types[self.current_player[games]],
+                [t.value for t in POLICIES],
+            )
+        ]
+        self.start_rounds(games)
+        plays, legal = self.legal_plays(games)
+        chosen = np.full(len(games), PASS_ID)
+        can_play = legal.any(axis=1)
+        current = types[self.current_player[games]]
+        for t, policy in POLICIES.items():
+            rows = np.flatnonzero(can_play & (current == t.value))
+            if len(rows):
+                uniforms = np.array(
+                    [self.randoms[g].random() for g in games[rows]]
+                )
+                chosen[rows] = policy(plays[rows], legal[rows], uniforms)
+        self.play(games, chosen)
+        return chosen
+
+    def run(self) -> np.ndarray:
+        """Play every game to the end and return the winning seats."""
+        assert all(
+            t in POLICIES for t in self.player_types
+        ), "Only heuristic players can be run"
+        while (self.winner < 0).any():
+            self.step()
+        return self.winner
+
+    def win_counts(self) -> np.ndarray:
+        """Return how many games each seat won."""
+        return np.bincount(
+            self.winner[self.winner >= 0], minlength=len(self.player_types)
+        )
@@ -0,0 +1,121 @@
+"""
+Immutable snapshots of a Big Two game.
+
+A GameState holds a whole game in a few ints: a bitmask hand per seat,
+the catalogue id of the last play, a bitmask of the seats that passed, the
+turn indices and a bitmask of the cards played so far. apply() returns the
+state after a play without touching the old one, so search can branch from
+a state as often as it likes. BigTwoGame.snapshot() and
+BigTwoGame.restore() convert between the two.
+"""
+
+import functools
+from typing import NamedTuple
+import numpy as np
+from bitmask import THREE_OF_DIAMONDS
+from catalogue import ANY_ID, PASS_ID, get_catalogue
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _legal_plays(
+    hand: int, last_play: int, game_start: bool
+) -> tuple[int, ...]:
+    """Return the ids of the plays in hand that beat last_play."""
+    catalogue = get_catalogue()
+    legal = catalogue.legal_mask(hand, last_play, game_start)
+    return tuple(np.flatnonzero(legal).tolist())
+
+
+class GameState(NamedTuple):
+    """
+    A game between len(hands) seats.
+
+    Plays are catalogue ids, PASS_ID to pass. last_play is ANY_ID at the
+    start of a round and bit i of passes is set if seat i passed since
+    the round started and has not played since. played holds every card
+    played this game.
+    """
+
+    hands: tuple[int, ...]
+    last_play: int = ANY_ID
+    passes: int = 0
+    current_player: int = 0
+    last_player: int = 0
+    turns: int = 0
+    winner: int = -1
+    played: int = 0
+
+    @classmethod
+    def deal(cls, hands: list[int]) -> "GameState":
+        """Start a game, the seat with the 3 of Diamonds plays first."""
+        first = next(i for i, h in enumerate(hands) if h & THREE_OF_DIAMONDS)
+        return cls(tuple(hands), current_player=first)
+
+    def is_over(self) -> bool:
+        return self.winner >= 0
+
+    def legal_actions(self) -> tuple[int, ...]:
+        """
+        Return the ids of the current player's plays in find_plays order,
+        then PASS_ID unless the player leads the round.
+        """
+        if self.winner >= 0:
+            return ()
+        plays = _legal_plays(
+            self.hands[self.current_player], self.last_play, self.turns == 0
+        )
+        if self.last_play == ANY_ID:
+            return plays
+        return plays + (PASS_ID,)
+
+    def apply(self, action: int) -> "GameState":
+        """
+        Return the state after the current player makes the play action.
+
+        The turn passes to the next seat, which starts a new round if all
+        other seats passed. A player who empties their hand wins.
+        """
+        assert self.winner < 0, "Game is over"
+        current = self.current_player
+        hands = self.hands
+        last_play = self.last_play
+        last_player = self.last_player
+        played = self.played
+        if action == PASS_ID:
+            passes = self.passes | 1 << current
+        else:
+            mask = int(get_catalogue().masks[action])
+            assert hands[current] & mask == mask, "Play not in hand"
+            hand = hands[current] & ~mask
+            hands = hands[:current] + (hand,) + hands[current + 1 :]
+            last_play = action
+            last_player = current
+            passes = self.passes & ~(1 << current)
+            played |= mask
+            if not hand:
+                return GameState(
+                    hands,
+                    last_play,
+                    passes,
+                    current,
+                    last_player,
+                    self.turns + 1,
+                    winner=current,
+                    played=played,
+                )
+        num_players = len(hands)
+        current = (current + 1) % num_players
+        others = ((1 << num_players) - 1) & ~(1 << current)
+        if passes & others == others:
+            # Everyone else passed, the new current player leads
+            last_play = ANY_ID
+            passes = 0
+        return GameState(
+            hands,
+            last_play,
+            passes,
+            current,
+            last_player,
+            self.turns + 1,
+            played=played,
+        )
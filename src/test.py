@@ -1,6 +1,31 @@
+import pytest
+from bisect import bisect_right
+from collections import defaultdict
 from card import *
+from bitmask import *
+from batch import *
+from catalogue import *
 from player import *
+from qtable import *
+from replay import ReplayBuffer
+from encoders import *
+from state import GameState
+from mcts import *
+from simulator import *
 from env import *
+from parallel import merge_shards, train_agent_parallel
+from pools import pool_size
+from main import (
+    BigTwoGame,
+    EVALUATION_OPPONENTS,
+    Experiment,
+    evaluate_agent,
+    load_agent,
+    register_env,
+    run_experiments,
+    types_to_agents,
+    write_results,
+)
 
 
 def test_compare_pairs():
@@ -91,6 +116,18 @@ def test_compare_fourofakinds():
     )
 
 
+def test_interned_cards():
+    import pickle
+
+    card = Card("Hearts", "7")
+    assert card is Card("Hearts", "7")
+    assert card is CARDS[card.card_index()]
+    assert pickle.loads(pickle.dumps(card)) is card
+    assert (card.index, card.rank_idx, card.suit_idx) == (18, 4, 2)
+    assert Card("Diamonds", "7") < card < Card("Diamonds", "8")
+    assert sorted(Deck(0).cards) == list(CARDS)
+
+
 def test_compare_cardcombinations():
     assert CardCombination.SINGLE < CardCombination.TRIPLE
     assert CardCombination.PAIR == CardCombination.PAIR
@@ -543,6 +580,22 @@ def test_validate_straights_special():
     assert len(p.find_plays(last_play).available_plays) == 0
 
 
+def test_straight_masks():
+    rng = random.Random(3)
+    for _ in range(200):
+        hand = cards2mask(rng.sample(CARDS, rng.choice([13, 26, 52])))
+        every_straight = straight_masks(hand)
+        assert every_straight == [
+            m
+            for m, c in find_play_masks(hand)
+            if c == CardCombination.STRAIGHT
+        ]
+        min_key = rng.randrange(-1, 52)
+        assert straight_masks(hand, min_key) == [
+            m for m in every_straight if highest(m) > min_key
+        ]
+
+
 def test_construct_plays():
     pair = [Card("Hearts", "2"), Card("Clubs", "2")]
     assert is_pair(pair)
@@ -611,6 +664,27 @@ def test_identify_combinations():
     assert identify_combination(hand) == CardCombination.STRAIGHT
 
 
+def test_classify():
+    assert len(combination_table()) == 13766
+    fullhouse = [
+        Card("Clubs", "7"),
+        Card("Spades", "4"),
+        Card("Diamonds", "7"),
+        Card("Clubs", "4"),
+        Card("Hearts", "4"),
+    ]
+    play = Play(fullhouse, CardCombination.FULLHOUSE)
+    assert classify(cards2mask(fullhouse)) == (play.combination, play.key)
+    assert classify(0) == (CardCombination.INVALID, -1)
+
+    rng = random.Random(0)
+    masks = [cards2mask(rng.sample(CARDS, 5)) for _ in range(1000)]
+    masks += list(combination_table())[::50]
+    combinations, keys = classify_many(masks)
+    for m, c, k in zip(masks, combinations, keys):
+        assert classify(m) == (CardCombination(c), k)
+
+
 def test_start_game():
     hand = [
         Card("Clubs", "3"),
@@ -882,6 +956,52 @@ def test_playitsafe_player():
     )
 
 
+def test_move_index():
+    rng = random.Random(2)
+    hand = rng.sample(CARDS, 13)
+    p = Player(name="Indexy", hand=hand)
+    single = p.find_plays().available_plays[0]
+    while p.hand:
+        last_play = rng.choice([Play(), single])
+        fresh = Player(name="Fresh", hand=p.hand)
+        assert (
+            p.find_plays(last_play).available_plays
+            == fresh.find_plays(last_play).available_plays
+        )
+        play = rng.choice(p.find_plays().available_plays)
+        p.remove_cards(play.mask)
+
+    # Replacing the hand outright rebuilds the index
+    p.hand = hand
+    assert len(p.find_plays().available_plays) == len(
+        Player(name="Fresh", hand=hand).find_plays().available_plays
+    )
+
+
+def test_iter_plays():
+    rng = random.Random(8)
+    for _ in range(20):
+        hand = rng.sample(CARDS, 13)
+        p = Player(name="Streamy", hand=hand)
+        plays = p.find_plays().available_plays
+        for last_play in [Play()] + rng.sample(plays, 5):
+            for game_start in (False, True):
+                eager = p.find_plays(last_play, game_start).available_plays
+                ranked = sorted(eager, key=lambda p: (p.combination, p.key))
+                assert list(p.iter_plays(last_play, game_start)) == ranked
+                assert list(p.iter_plays(last_play, game_start, True)) == (
+                    ranked[::-1]
+                )
+                lazy = p.find_plays(last_play, game_start, lazy=True)
+                assert list(lazy.iter_plays()) == ranked
+                assert lazy.available_plays == eager
+
+    # Taking the strongest play only builds that Play
+    p = Player(name="Streamy", hand=hand)
+    strongest = next(p.iter_plays(reverse=True))
+    assert p._plays == {strongest.mask: strongest}
+
+
 def test_no_options():
     """make_play should not be called when forced to pass."""
     hand = [Card("Clubs", "J")]
@@ -1012,6 +1132,710 @@ def test_box2cards():
     assert box2cards(box) == validation_cards
 
 
+def test_cards2mask():
+    cards = [
+        Card("Clubs", "3"),
+        Card("Hearts", "7"),
+        Card("Spades", "2"),
+    ]
+
+    mask = cards2mask(cards)
+    assert mask == (1 << 1) | (1 << 18) | (1 << 51)
+    assert mask2cards(mask) == sorted(cards)
+    assert box2mask(cards2box(cards)) == mask
+    assert list(mask2box(mask)) == list(cards2box(cards))
+
+
+def test_mask2play():
+    for m, c in find_play_masks(FULL_DECK):
+        fast = mask2play(m, c)
+        slow = Play(mask2cards(m), c)
+        assert fast.cards == slow.cards
+        assert (fast.mask, fast.key) == (slow.mask, slow.key)
+        assert fast == slow and hash(fast) == hash(slow)
+
+    # Default Plays do not share their cards
+    a, b = Play(), Play()
+    a.cards.append(Card("Clubs", "3"))
+    assert b.cards == []
+
+
+def test_find_play_masks():
+    hand = [
+        Card("Diamonds", "5"),
+        Card("Hearts", "5"),
+        Card("Spades", "5"),
+        Card("Clubs", "9"),
+    ]
+
+    # A pair of the same rank wins on its best suit
+    last_play = Play(
+        [Card("Diamonds", "5"), Card("Clubs", "5")], CardCombination.PAIR
+    )
+    p = Player(name="Masky", hand=hand)
+    moves = find_play_masks(
+        cards2mask(p.hand), last_play.combination, last_play.key
+    )
+    assert [mask2play(m, c) for m, c in moves] == p.find_plays(
+        last_play
+    ).available_plays
+    PAIR = CardCombination.PAIR
+    assert p.find_plays(last_play).available_plays == [
+        Play([Card("Diamonds", "5"), Card("Hearts", "5")], PAIR),
+        Play([Card("Diamonds", "5"), Card("Spades", "5")], PAIR),
+        Play([Card("Hearts", "5"), Card("Spades", "5")], PAIR),
+    ]
+
+    p.remove_cards(cards2mask([Card("Spades", "5"), Card("Clubs", "9")]))
+    assert p.hand == [Card("Diamonds", "5"), Card("Hearts", "5")]
+
+
+def test_find_plays_batch():
+    rng = random.Random(0)
+    every_play = list(combination_table().items())
+    hands, last_plays, game_starts = [], [], []
+    for i in range(200):
+        hands.append(rng.sample(CARDS, rng.choice([5, 13, 26])))
+        if i % 3 == 0:
+            last_plays.append(Play())
+        else:
+            mask, (combination, _) = rng.choice(every_play)
+            last_plays.append(mask2play(mask, combination))
+        game_starts.append(i % 5 == 0)
+
+    legal = find_plays_batch(
+        np.array([cards2box(h) for h in hands]),
+        last_plays,
+        np.array(game_starts),
+    )
+    for i, hand in enumerate(hands):
+        p = Player(name="Batchy", hand=hand)
+        ctx = p.find_plays(last_plays[i], game_starts[i])
+        assert plays_of(legal[i]) == ctx.available_plays
+        assert len(legal_indices(legal)[i]) == len(ctx.available_plays)
+
+
+def test_catalogue(tmp_path):
+    catalogue = PlayCatalogue.build()
+    assert len(catalogue) == NUM_PLAYS
+    path = str(tmp_path / "catalogue.npz")
+    catalogue.save(path)
+    loaded = PlayCatalogue.load(path)
+    assert (loaded.masks == catalogue.masks).all()
+    # A partly written cache is rebuilt
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[: len(data) // 2])
+    assert (load_or_build(path).masks == catalogue.masks).all()
+    assert (PlayCatalogue.load(path).masks == catalogue.masks).all()
+    assert os.listdir(tmp_path) == ["catalogue.npz"]
+
+    every_play = Player(name="Deck", hand=list(CARDS)).find_plays()
+    for i, play in enumerate(every_play.available_plays):
+        assert catalogue.id_of(play) == i
+        assert catalogue.play(i) == play
+    assert catalogue.id_of(Play()) == ANY_ID
+    assert catalogue.play(PASS_ID).combination == CardCombination.PASS
+
+    rng = random.Random(1)
+    for i in range(100):
+        hand = rng.sample(CARDS, 13)
+        last_play_id = ANY_ID if i % 4 == 0 else rng.randrange(NUM_PLAYS)
+        last_play = catalogue.play(last_play_id)
+        legal = catalogue.legal_mask(
+            cards2mask(hand), last_play_id, i % 3 == 0
+        )
+        ctx = Player(name="Cat", hand=hand).find_plays(last_play, i % 3 == 0)
+        assert [catalogue.play(j) for j in np.flatnonzero(legal)] == (
+            ctx.available_plays
+        )
+
+
+def test_simulator_policies():
+    catalogue = get_catalogue()
+    rng = random.Random(10)
+    for i in range(200):
+        hand = rng.sample(CARDS, 13)
+        plays = np.flatnonzero(catalogue.legal_mask(cards2mask(hand), ANY_ID))
+        last_play_id = ANY_ID if i % 4 == 0 else rng.choice(plays)
+        legal = catalogue.legal_mask(
+            cards2mask(hand), last_play_id, i % 5 == 0
+        )[plays]
+        if not legal.any():
+            continue
+        for player, policy in [
+            (AggressivePlayer, aggressive_policy),
+            (PlayItSafePlayer, play_it_safe_policy),
+        ]:
+            p = player(name="Batchy", hand=hand)
+            ctx = p.find_plays(catalogue.play(last_play_id), i % 5 == 0)
+            chosen = policy(plays[None], legal[None])[0]
+            assert catalogue.play(chosen) == p.make_play(ctx)
+
+
+def test_batched_simulator():
+    for player_types in (
+        [PlayerType.Aggressive] + [PlayerType.Random] * 3,
+        [PlayerType.PlayItSafe, PlayerType.Random],
+    ):
+        simulator = BatchedBigTwoSimulator(player_types, 50, seed=0)
+        hand_size = 21 if len(player_types) == 2 else 13
+        assert (simulator.hands.sum(axis=2) == hand_size).all()
+        assert simulator.hands[:, :, 0].any(axis=1).all()
+        winner = simulator.run()
+        games = np.arange(50)
+        assert not simulator.hands[games, winner].any()
+        assert (simulator.hands.sum(axis=2) > 0).sum(axis=1).min() == (
+            len(player_types) - 1
+        )
+        assert simulator.win_counts().sum() == 50
+
+
+def test_vector_env():
+    envs = BigTwoVectorEnv(8)
+    obs, info = envs.reset(seed=5)
+    assert envs.observation_space.contains(obs)
+    # Every game has its own seed
+    single = BigTwoVectorEnv(1)
+    single_obs, _ = single.reset(seed=8)
+    assert (single_obs[1][0] == obs[1][3]).all()
+    listed = BigTwoVectorEnv(3)
+    listed_obs, _ = listed.reset(seed=[9, 8, 5])
+    assert (listed_obs[1][1] == obs[1][3]).all()
+    assert (listed_obs[1][2] == obs[1][0]).all()
+
+    rng = np.random.default_rng(0)
+    ended = np.zeros(8, dtype=bool)
+    for _ in range(200):
+        mask = info["action_mask"]
+        actions = (rng.random(mask.shape) * mask).argmax(axis=1)
+        obs, rewards, terminated, _, info = envs.step(actions)
+        # Games that ended are dealt again on the next step
+        assert (obs[1][ended].sum(axis=1) == 13).all()
+        assert (rewards[ended] == 0).all()
+        # Only winning gives 100
+        won = terminated & (obs[1].sum(axis=1) == 0)
+        assert ((rewards >= 100) == won).all()
+        ended = terminated
+
+
+def test_env_action_mask():
+    rl_agent = RLAgent(name="RLAgent", hand=[], id=-1)
+    game = BigTwoGame(
+        [rl_agent] + types_to_agents([PlayerType.Random] * 3), seed=2
+    )
+    env = BigTwoEnv(game)
+    obs, info = env.reset(seed=2)
+    done = False
+    while not done:
+        mask = info["action_mask"]
+        assert mask.dtype == np.int8 and mask[PASS_ACTION] == 1
+        assert set(np.flatnonzero(mask)) == {PASS_ACTION} | {
+            play2discrete(p) for p in env.turn_context.available_plays
+        }
+        action = int(env.action_space.sample(mask))
+        play = env.legal_plays[action]
+        hand = rl_agent.hand
+        obs, reward, done, _, info = env.step(action)
+        # The submitted action is the one played
+        assert rl_agent.hand == [c for c in hand if c not in play.cards]
+    assert not info["action_mask"].any()
+    env.reset()
+    illegal = np.flatnonzero(env.action_mask() == 0)[0]
+    with pytest.raises(AssertionError):
+        env.step(illegal)
+
+
+def test_turn_context_cache():
+    rl_agent = RLAgent(name="RLAgent", hand=[], id=-1)
+    game = BigTwoGame(
+        [rl_agent] + types_to_agents([PlayerType.Random] * 3), seed=9
+    )
+    env = BigTwoEnv(game)
+    env.reset()
+    plays = []
+    while len(plays) < 2:
+        # Pass until an action has more than one play
+        if plays:
+            env.step(PASS_ACTION)
+        ctx = game.turn_context()
+        assert ctx is env.turn_context and game.turn_context() is ctx
+        by_action = defaultdict(list)
+        for play in ctx.available_plays:
+            by_action[play2discrete(play)].append(play)
+        action, plays = max(
+            by_action.items(), key=lambda e: len(e[1]), default=(0, [None])
+        )
+    # Choose a play that is not the first of its action
+    assert env.legal_plays[action] is plays[0]
+    ctx.chosen = plays[-1]
+    hand = rl_agent.hand
+    env.step(action)
+    assert rl_agent.hand == [c for c in hand if c not in plays[-1].cards]
+    assert game.turn_context() is not ctx
+    env.reset()
+    assert game.turn_context().chosen is None
+    # A new round or another seat at the same turn gets new plays
+    ctx = game.turn_context()
+    game.last_play = last_play = get_catalogue().play(0)
+    assert game.turn_context() is not ctx
+    assert game.turn_context().last_play is last_play
+    ctx = game.turn_context()
+    game.next_player()
+    assert game.turn_context() is not ctx
+
+
+def test_qtable():
+    hand = cards2box([Card("Diamonds", "3"), Card("Spades", "2")])
+    state = state_key(52 + 3, hand)
+    assert unpack_state(state) == (55, cards2mask(box2cards(hand)))
+
+    q_values = QTable()
+    assert state not in q_values
+    q_obs = q_values[state]
+    assert state in q_values and len(q_obs) == 0
+    assert q_obs[7] == 0.0 and 7 in q_obs
+    # Grow past the room a new state gets
+    for a in range(10, 0, -1):
+        q_obs[a] = float(a % 3)
+    q_obs[7] += 1.0
+    assert list(q_obs.keys()) == [7] + [10, 9, 8, 6, 5, 4, 3, 2, 1]
+    assert q_obs[7] == 2.0 and q_obs.get(11) is None
+    assert q_obs.best_actions() == [7, 8, 5, 2]
+    assert q_values.get(state + 1) is None
+    q_values[state + 1][0] = 1.0
+    assert len(q_values) == 2 and q_values.num_actions() == 11
+    assert q_values[state][1] == 1.0
+
+
+def test_qtable_save(tmp_path):
+    q_values = QTable()
+    for state in (9 << 9 | 312, 3, 1 << 60):
+        for a in range(state % 7 + 5):
+            q_values[state][(a * 53) % 313] = state % 10 - a / 4
+    q_values[42]
+    path = tmp_path / "agent.qtable"
+    q_values.save(path)
+
+    frozen = FrozenQTable(path)
+    loaded = QTable.load(path)
+    assert frozen.keys() == sorted(q_values.keys())
+    assert sorted(loaded.keys()) == frozen.keys()
+    assert 4 not in frozen and frozen.get(4) is None
+    for state, q_obs in q_values.items():
+        for table in (frozen, loaded):
+            assert list(table[state].items()) == list(q_obs.items())
+        if len(q_obs):
+            assert frozen[state].best_actions() == q_obs.best_actions()
+    assert frozen.num_actions() == loaded.num_actions() == 25
+    loaded[3][1] = 1.0
+    assert loaded[3][1] == 1.0 and len(loaded[3]) == 9
+    # A state saved without actions can grow after loading
+    for a in range(INITIAL_CAPACITY + 1):
+        loaded[42][a] = 2.0 + a
+    assert list(loaded[42].values()) == [2.0, 3.0, 4.0, 5.0, 6.0]
+
+    rl_agent = load_agent(path, epsilon=0.0)
+    assert rl_agent.q_values.get(3)[0] == 3.0
+    evaluation = evaluate_agent(rl_agent, trials=2, workers=1)
+    assert evaluation.trials == 2
+    # Loaded agents only play
+    with pytest.raises(AssertionError, match="frozen"):
+        rl_agent.update(None, 0, 0.0, True, None, {})
+
+
+def test_rlagent_make_play():
+    hand = [
+        Card("Diamonds", "3"),
+        Card("Clubs", "3"),
+        Card("Hearts", "7"),
+        Card("Spades", "K"),
+    ]
+    rl_agent = RLAgent(name="RLAgent", hand=hand, id=0, initial_epsilon=0.0)
+    obs = (play2discrete(Play()), cards2box(hand))
+    ctx = rl_agent.find_plays()
+    pair = play2discrete(ctx.available_plays[4])
+    king = play2discrete(ctx.available_plays[3])
+    q_obs = rl_agent.q_values[rl_agent.make_obs_hashable(obs)]
+    # The best action is illegal here, a pair of 2s
+    q_obs[52 * 1 + 51] = 5.0
+    q_obs[pair] = 1.0
+    q_obs[king] = 2.0
+    assert rl_agent.make_play(ctx, obs) == ctx.available_plays[3]
+    q_obs[pair] = 2.0
+    played = {rl_agent.make_play(ctx, obs) for _ in range(30)}
+    assert played == {ctx.available_plays[3], ctx.available_plays[4]}
+    q_obs[PASS_ACTION] = 3.0
+    assert rl_agent.make_play(ctx, obs).combination == CardCombination.PASS
+    assert rl_agent.play_history[0] == ctx.available_plays[3]
+
+
+def test_replay_buffer():
+    replay = ReplayBuffer(capacity=3, n_step=2, gamma=0.5)
+    replay.add(1, 10, 4.0, False, 2)
+    assert len(replay) == 0
+    replay.add(2, 20, 2.0, False, 3)
+    replay.add(3, 30, 8.0, True, 4)
+    assert len(replay) == 3 and not replay.pending
+    assert replay.states.tolist() == [1, 2, 3]
+    assert replay.rewards.tolist() == [4.0 + 1.0, 2.0 + 4.0, 8.0]
+    assert replay.next_states.tolist() == [3, 4, 4]
+    assert replay.dones.tolist() == [False, True, True]
+    assert replay.discounts.tolist() == [0.25, 0.25, 0.5]
+    # The oldest transition is overwritten
+    replay.add(5, 50, 1.0, True, 6)
+    assert replay.states.tolist() == [5, 2, 3] and len(replay) == 3
+    states, *_ = replay.sample(8)
+    assert set(states.tolist()) <= {2, 3, 5}
+
+
+def test_rlagent_learn():
+    batch = (
+        np.array([1, 1, 2], dtype=np.uint64),
+        np.array([0, 5, 0]),
+        np.array([1.0, 2.0, 3.0]),
+        np.array([False, False, True]),
+        np.array([2, 3, 1], dtype=np.uint64),
+        np.full(3, 0.9),
+    )
+    rl_agent = RLAgent(name="RLAgent", hand=[], id=-1, alpha=0.5)
+    rl_agent.q_values[2][4] = 10.0
+    rl_agent.q_values[2][0] = 4.0
+    rl_agent.learn(batch)
+    q_values = rl_agent.q_values
+    assert q_values[1][0] == 0.5 * (1.0 + 0.9 * 10.0)
+    assert q_values[1][5] == 0.5 * 2.0
+    assert q_values[2][0] == 4.0 + 0.5 * (3.0 - 4.0)
+    assert q_values.max_values([1, 2, 7]).tolist() == [5.0, 10.0, 0.0]
+
+    rl_agent = RLAgent(
+        name="RLAgent", hand=[], id=-1, replay_capacity=100, batch_size=4
+    )
+    obs = (PASS_ACTION, np.zeros(52, dtype=np.int8))
+    for step in range(8):
+        rl_agent.update(obs, step, 1.0, step % 4 == 3, obs, {})
+    assert len(rl_agent.replay) == 8
+    assert 0 < rl_agent.q_values.num_actions() <= 8
+
+
+def test_encoders():
+    PAIR = CardCombination.PAIR
+    hand = [Card("Diamonds", "3"), Card("Clubs", "5"), Card("Hearts", "5")]
+    relabelled = [
+        Card("Spades", "3"),
+        Card("Diamonds", "5"),
+        Card("Spades", "5"),
+    ]
+    pair = play2discrete(
+        Play([Card("Clubs", "9"), Card("Spades", "9")], CardCombination.PAIR)
+    )
+    other_pair = play2discrete(
+        Play(
+            [Card("Diamonds", "9"), Card("Hearts", "9")], CardCombination.PAIR
+        )
+    )
+    exact, ranks, sizes = (
+        ObservationEncoder(),
+        RankEncoder(),
+        HandSizeEncoder(),
+    )
+
+    obs = (pair, cards2box(hand))
+    assert exact(obs) == state_key(*obs)
+    assert exact(obs) != exact((other_pair, cards2box(relabelled)))
+    assert ranks(obs) == ranks((other_pair, cards2box(relabelled)))
+    assert ranks(obs) != ranks((pair, cards2box(hand[:2])))
+    assert sizes(obs) == sizes((other_pair, cards2box(hand[1:] + hand[:1])))
+    assert sizes(obs) != sizes((PASS_ACTION + 1, cards2box(hand)))
+    assert sizes(obs) < sizes.size and ranks(obs) < ranks.size
+
+    # Coarse encoders key actions without suits too
+    nines = Play([Card("Diamonds", "9"), Card("Spades", "9")], PAIR)
+    assert ranks.action_keys(obs)(nines.mask) == last_play_rank(pair)
+    assert sizes.action_keys(obs)(nines.mask) == last_play_rank(other_pair)
+    assert ranks.action_keys(obs)(0) == last_play_rank(PASS_ACTION)
+    start = (PASS_ACTION + 1, cards2box(hand))
+    plays = Player(name="Hand", hand=hand).find_plays().available_plays
+    assert exact.legal_keys(start) == {play2discrete(p) for p in plays} | {
+        PASS_ACTION
+    }
+    # Nothing in hand beats the pair of 9s
+    assert ranks.legal_keys(obs) == {last_play_rank(PASS_ACTION)}
+
+    # Only legal actions are bootstrapped from
+    rl_agent = RLAgent(
+        name="RLAgent", hand=[], id=-1, alpha=1.0, gamma=0.5, encoder=ranks
+    )
+    next_row = rl_agent.q_values[ranks(obs)]
+    next_row[last_play_rank(pair) + 1] = 100.0
+    next_row[last_play_rank(PASS_ACTION)] = 1.0
+    fives = Play([Card("Clubs", "5"), Card("Hearts", "5")], PAIR)
+    rl_agent.update(start, play2discrete(fives), 0.0, False, obs, {}, fives)
+    fives_key = ranks.action_keys(start)(fives.mask)
+    assert rl_agent.q_values[ranks(start)][fives_key] == 0.5
+
+    rl_agent = RLAgent(name="RLAgent", hand=[], id=-1, encoder=ranks)
+    game = BigTwoGame(
+        [rl_agent] + [Player(name=f"P{i}") for i in range(3)], seed=0
+    )
+    env = BigTwoEnv(game, encoder=ranks)
+    obs, _ = env.reset()
+    assert env.observation_space.contains(obs)
+    assert rl_agent.make_obs_hashable(obs) == obs
+
+
+def test_suit_encoder():
+    def obs(last_play: Play, hand: list[Card]):
+        return (play2discrete(last_play), cards2box(hand))
+
+    def single(suit: str, rank: str) -> Play:
+        return Play([Card(suit, rank)], CardCombination.SINGLE)
+
+    encoder = SuitEncoder()
+    hand = [Card("Clubs", "5"), Card("Hearts", "9"), Card("Spades", "9")]
+    # Swapping clubs with diamonds and hearts with spades
+    relabelled = [
+        Card("Diamonds", "5"),
+        Card("Spades", "9"),
+        Card("Hearts", "9"),
+    ]
+    assert encoder(obs(Play(), hand)) == encoder(obs(Play(), relabelled))
+    # 5♣ beats 5♦ but 5♦ does not beat 5♣
+    assert encoder(obs(single("Diamonds", "5"), hand)) != encoder(
+        obs(single("Clubs", "5"), relabelled)
+    )
+    # Both beat the 5 below them
+    assert encoder(obs(single("Diamonds", "5"), hand[:1])) == encoder(
+        obs(single("Clubs", "5"), [Card("Spades", "5")])
+    )
+    # The 3 of Diamonds may have to start the game
+    three = [Card("Diamonds", "3")]
+    assert encoder(obs(Play(), three)) != encoder(
+        obs(Play(), [Card("Clubs", "3")])
+    )
+
+    # Plays are relabelled like the hand
+    _, canonical_hand = unpack_state(encoder(obs(Play(), hand)))
+    action_key = encoder.action_keys(obs(Play(), hand))
+    mask_actions = get_catalogue().mask_actions
+    canonical_plays = {
+        mask_actions[m] for m, _ in find_play_masks(canonical_hand)
+    }
+    for play in Player(name="Hand", hand=hand).find_plays().available_plays:
+        assert action_key(play.mask) in canonical_plays
+    assert action_key(0) == PASS_ACTION
+    # Matching plays of equivalent hands share their action, even when
+    # relabelling changes which card is the key
+    pairs = [Card("Diamonds", r) for r in ("5", "9", "K")]
+    pairs += [Card("Clubs", "5"), Card("Spades", "9")]
+    swap = (3, 1, 2, 0)  # Diamonds and spades
+    swapped = mask2cards(permute_suits(cards2mask(pairs), swap))
+    keys = encoder.action_keys(obs(Play(), pairs))
+    swapped_keys = encoder.action_keys(obs(Play(), swapped))
+    for m, _ in find_play_masks(cards2mask(pairs)):
+        assert keys(m) == swapped_keys(permute_suits(m, swap))
+    with pytest.raises(AssertionError):
+        encoder.action_keys(encoder(obs(Play(), hand)))
+
+    rl_agent = RLAgent(
+        name="RLAgent", hand=hand, id=0, initial_epsilon=0.0, encoder=encoder
+    )
+    ctx = rl_agent.find_plays()
+    q_obs = rl_agent.q_values[encoder(obs(Play(), hand))]
+    q_obs[action_key(ctx.available_plays[2].mask)] = 1.0
+    assert rl_agent.make_play(ctx, obs(Play(), hand)) == ctx.available_plays[2]
+    assert rl_agent.encode_action(
+        obs(Play(), hand), 0, ctx.available_plays[2]
+    ) == action_key(ctx.available_plays[2].mask)
+
+
+def test_game_winner():
+    game = BigTwoGame(types_to_agents([PlayerType.Aggressive] * 4), seed=3)
+    assert game.cards_left == [13] * 4 and not game.is_game_over()
+    winner = game.start()
+    assert winner is game.winner
+    assert game.cards_left == [len(p.hand) for p in game.players]
+    assert [p for p in game.players if not p.has_cards()] == [game.winner]
+    game.setup()
+    assert game.winner is None and game.cards_left == [13] * 4
+
+
+def test_game_state():
+    game = BigTwoGame(types_to_agents([PlayerType.Aggressive] * 4), seed=6)
+    catalogue = get_catalogue()
+    state = game.snapshot()
+    assert state == GameState.deal(list(state.hands))
+    # The first player leads with the 3 of Diamonds and may not pass
+    assert PASS_ID not in state.legal_actions()
+    assert all(catalogue.game_starts[a] for a in state.legal_actions())
+    while not state.is_over():
+        if game.check_other_passes():
+            game.last_play = Play()
+            game.passes = [False] * 4
+        player = game.current_player_index
+        game.play_turn()
+        played = not game.passes[player]
+        action = catalogue.id_of(game.last_play) if played else PASS_ID
+        assert action in state.legal_actions()
+        game.turns += 1
+        if not game.is_game_over():
+            game.next_player()
+        next_state = state.apply(action)
+        assert next_state == game.snapshot() and next_state != state
+        state = next_state
+    assert game.players[state.winner] is game.winner
+    assert state.legal_actions() == ()
+
+    other = BigTwoGame(types_to_agents([PlayerType.Aggressive] * 4))
+    other.restore(state)
+    assert other.snapshot() == state
+    assert other.cards_left == game.cards_left and other.winner is not None
+
+
+def test_mcts_player():
+    import pickle
+
+    random.seed(0)
+    player = MCTSPlayer(name="MCTS", iterations=20)
+    game = BigTwoGame(
+        [player] + types_to_agents([PlayerType.Aggressive] * 3), seed=7
+    )
+    state = game.snapshot()
+    dealt = determinise(state, 1, random.Random(0))
+    assert dealt.hands[1] == state.hands[1]
+    assert [h.bit_count() for h in dealt.hands] == [13] * 4
+    assert sum(dealt.hands) == FULL_DECK
+    # Played cards are never dealt again
+    after = state.apply(state.legal_actions()[0])
+    assert after.played == int(get_catalogue().masks[after.last_play])
+    dealt = determinise(after, 1, random.Random(0))
+    assert not any(h & after.played for h in dealt.hands)
+    # With 2 players the opponent's cards are drawn from the undealt ones too
+    duel = BigTwoGame(types_to_agents([PlayerType.Aggressive] * 2), seed=7)
+    duel_state = duel.snapshot()
+    dealt = determinise(duel_state, 0, random.Random(0))
+    assert dealt.hands[1].bit_count() == duel_state.hands[1].bit_count()
+    assert dealt.hands[1] & ~duel_state.hands[1]
+    visits = search(state, iterations=30, seed=0)
+    assert set(visits) <= set(state.legal_actions())
+    assert sum(visits.values()) == 30
+    assert game.start() is game.winner
+
+    # Root parallel search plays a legal move
+    game.setup()
+    player.workers = 2
+    # Let the player lead a round after the first turn
+    game.restore(game.snapshot()._replace(current_player=0, turns=1))
+    ctx = game.turn_context()
+    assert player.make_play(ctx) in ctx.available_plays
+    # The worker processes are kept for the next move
+    pool = player._pool
+    assert pool is not None
+    assert player.make_play(ctx) in ctx.available_plays
+    assert player._pool is pool
+    assert pickle.loads(pickle.dumps(player))._pool is None
+    player.close()
+    assert player._pool is None
+
+
+def test_merge_shards():
+    shards = [
+        {7: {0: (1.0, 1), 1: (4.0, 3)}},
+        {7: {1: (8.0, 1)}, 9: {2: (2.0, 2)}},
+    ]
+    q_values = QTable()
+    q_values[7][0] = 3.0
+    merged = merge_shards(q_values, shards, "mean")
+    # Workers that did not update a value still hold the master value
+    assert merged == {7: {0: 2.0, 1: 6.0}, 9: {2: 1.0}}
+    assert q_values[7][1] == 6.0
+
+    merged = merge_shards(q_values, shards, "visits")
+    assert merged == {7: {0: 1.0, 1: 5.0}, 9: {2: 2.0}}
+
+
+def test_train_agent_parallel():
+    seen = []
+    rl_agent = train_agent_parallel(
+        episodes=12,
+        workers=2,
+        sync_every=3,
+        checkpoint=lambda agent, done: seen.append(done),
+    )
+    assert seen == [6, 12]
+    assert rl_agent.current_episode == 13
+    assert len(rl_agent.q_values) > 0
+    # The last batch is not rounded up to a multiple of workers
+    seen = []
+    rl_agent = train_agent_parallel(
+        episodes=10,
+        workers=4,
+        sync_every=2,
+        checkpoint=lambda agent, done: seen.append(done),
+    )
+    assert seen == [8, 10]
+    assert rl_agent.current_episode == 11
+
+
+def test_evaluate_agent():
+    rl_agent = RLAgent(name="RLAgent", hand=[], id=-1)
+    opponents = [PlayerType.Aggressive] * 3
+    serial = evaluate_agent(rl_agent, opponents, trials=12, workers=1)
+    parallel = evaluate_agent(rl_agent, opponents, trials=12, workers=3)
+    assert serial == parallel
+    assert serial.trials == 12 and serial.opponent_types == opponents
+    low, high = serial.confidence_interval()
+    assert 0 <= low <= serial.win_rate() <= high <= 1
+    # The caller's random streams are left alone
+    random.seed(5)
+    np.random.seed(5)
+    evaluate_agent(rl_agent, opponents, trials=2, workers=1)
+    streams = random.random(), np.random.random()
+    random.seed(5)
+    np.random.seed(5)
+    assert streams == (random.random(), np.random.random())
+    # A failed evaluation does not keep the agent either
+    import main
+
+    with pytest.raises(AssertionError):
+        evaluate_agent(rl_agent, [PlayerType.RLAgent] * 3, workers=1)
+    assert main._evaluated_agent is None
+
+
+def test_pool_size():
+    import multiprocessing
+
+    assert pool_size(4, 2) == 2 and pool_size(3) == 3
+    assert 1 <= pool_size(None, 5) <= 5
+    # Pool workers cannot start pools of their own
+    with multiprocessing.get_context("fork").Pool(1) as pool:
+        assert pool.apply(pool_size, (4,)) == 1
+
+
+def test_run_experiments(tmp_path):
+    register_env()
+    experiments = [
+        Experiment("R3E3", 3, [PlayerType.Random] * 3),
+        Experiment("A3E2D1", 2, [PlayerType.Aggressive] * 3, seed=1),
+    ]
+    results = run_experiments(experiments, workers=2)
+    assert [name for name, _ in results] == ["R3E3", "A3E2D1"]
+    for _, stats in results:
+        assert [e.opponent_types[0] for e in stats.evals] == list(
+            EVALUATION_OPPONENTS
+        )
+
+    write_results(results, tmp_path / "results.md")
+    lines = (tmp_path / "results.md").read_text().splitlines()
+    assert lines[0] == "# R3E3"
+    assert lines[3] == "## Evaluations"
+    assert lines[4].endswith(
+        "/100 games against `['Random', 'Random', 'Random']`"
+    )
+    assert lines[7] == "# A3E2D1"
+
+
 def test_env():
     e = BigTwoEnv()
     obs = e._get_obs()